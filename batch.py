@@ -0,0 +1,201 @@
+from __future__ import annotations
+from typing import Iterator, TextIO
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+from itertools import islice
+from time import perf_counter
+from os import cpu_count
+import argparse
+import json
+import sys
+
+from board import Board
+from engine import Engine
+from transposition import TranspositionTable
+from ordering import MoveOrdering
+from pieces import get_move_notation
+from records import POSITIONS_EXTENSION, read_position_records, decode_position
+
+# Each worker process keeps one engine and table, reloading the board for every position
+# the table and move ordering are reset before each search so results don't depend on which positions came before
+worker_engine = None
+worker_table = None
+
+# positions per task -> big enough that pickling and scheduling are small next to a chunk of move counts
+CHUNK_SIZE = 64
+# chunks queued per worker, only these and the output line being written are ever held in memory
+CHUNKS_PER_WORKER = 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a FEN or EPD file through the engine, writing one JSON result per position")
+    parser.add_argument("positions", help=f"FEN or EPD file with one position per line, - for stdin, or a {POSITIONS_EXTENSION} file of binary records")
+    parser.add_argument("--mode", choices=("moves", "perft", "search"), default="moves", help="count legal moves, run perft or search each position")
+    parser.add_argument("--depth", type=int, metavar="N", help="perft or search depth")
+    parser.add_argument("--time", type=float, metavar="SECONDS", help="time limit for each search")
+    parser.add_argument("--output", default="-", metavar="FILE", help="JSONL file to write, - for stdout")
+    parser.add_argument("--workers", type=int, default=0, metavar="N", help="worker processes, all cores by default and 1 to run in this process")
+    parser.add_argument("--hash", type=int, default=1, metavar="MB", help="transposition table size for each worker")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, metavar="N", help="positions sent to a worker at a time")
+    args = parser.parse_args()
+
+    if args.mode == "perft" and args.depth is None:
+        parser.error("perft needs a --depth")
+    if args.mode == "search" and args.depth is None and args.time is None:
+        parser.error("search needs a --depth, a --time or both")
+
+    # binary records are numbered from 0 in place of line numbers
+    if args.positions.endswith(POSITIONS_EXTENSION):
+        positions_file = None
+        positions = read_position_records(args.positions)
+    else:
+        positions_file = sys.stdin if args.positions == "-" else open(args.positions)
+        positions = read_positions(positions_file)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        start_time = perf_counter()
+        count = run_batch(positions, output_file, args.mode, args.depth, args.time, args.workers, args.hash, args.chunk)
+        elapsed_time = perf_counter() - start_time
+    finally:
+        if positions_file is not None and positions_file is not sys.stdin:
+            positions_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    # results go to the output, the summary goes to stderr so stdout stays valid JSONL
+    print(f"positions: {count}, time: {elapsed_time:.3f}s, positions/s: {int(count / max(elapsed_time, 1e-9))}", file=sys.stderr)
+
+
+def run_batch(positions: Iterator[tuple[int, str | bytes]], output_file: TextIO, mode: str, depth: int = None, time_limit: float = None,
+              workers: int = 0, hash_size: int = 1, chunk_size: int = CHUNK_SIZE) -> int:
+    # results are written in input order as soon as the oldest chunk is done, returns the number of positions
+    chunks = get_chunks(positions, chunk_size)
+    count = 0
+
+    if workers == 1:
+        start_worker(hash_size)
+        for chunk in chunks:
+            output_file.write(analyse_chunk(chunk, mode, depth, time_limit))
+            count += len(chunk)
+        return count
+
+    workers = workers or cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(hash_size,)) as executor:
+        # only a few chunks per worker are queued at once -> the input is never read far ahead of the output
+        pending: deque[tuple[int, Future]] = deque()
+        for chunk in chunks:
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                count += write_result(pending.popleft(), output_file)
+            pending.append((len(chunk), executor.submit(analyse_chunk, chunk, mode, depth, time_limit)))
+        while pending:
+            count += write_result(pending.popleft(), output_file)
+
+    return count
+
+def write_result(pending_chunk: tuple[int, Future], output_file: TextIO) -> int:
+    size, future = pending_chunk
+    output_file.write(future.result())
+    output_file.flush()
+    return size
+
+def read_positions(positions_file: TextIO) -> Iterator[tuple[int, str]]:
+    # (line number, line) for every line holding a position, blank lines and # comments are skipped
+    for line_number, line in enumerate(positions_file, 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line_number, line
+
+def get_chunks(positions: Iterator[tuple[int, str | bytes]], chunk_size: int) -> Iterator[list[tuple[int, str | bytes]]]:
+    while chunk := list(islice(positions, chunk_size)):
+        yield chunk
+
+def parse_position(line: str) -> tuple[str, dict[str, str]]:
+    # FEN lines have six fields, EPD lines have four followed by operations -> e.g. 'w KQkq - bm e4; id "start";' or '0 1 ;D1 20 ;D2 400'
+    fields, *operations = line.split(';')
+    tokens = fields.split()
+    if len(tokens) < 4:
+        raise ValueError("Expected at least four FEN fields")
+
+    has_clocks = len(tokens) >= 6 and tokens[4].isdigit() and tokens[5].isdigit()
+    rest = tokens[6:] if has_clocks else tokens[4:]
+    if rest:
+        operations.insert(0, ' '.join(rest))
+
+    epd_operations = {}
+    for operation in operations:
+        opcode, _, operand = operation.strip().partition(' ')
+        if opcode:
+            epd_operations[opcode] = operand.strip().strip('"')
+
+    # EPD keeps the clocks as operations if at all
+    if has_clocks:
+        half_moves, full_moves = tokens[4:6]
+    else:
+        half_moves, full_moves = epd_operations.get("hmvc", "0"), epd_operations.get("fmvn", "1")
+    return ' '.join(tokens[:4] + [half_moves, full_moves]), epd_operations
+
+def load_position(fen_string: str) -> Engine:
+    worker_engine.board.load_FEN(fen_string)
+    return worker_engine
+
+def load_record(record: bytes) -> Engine:
+    worker_engine.board.load_position(decode_position(record))
+    return worker_engine
+
+def start_worker(hash_size: int) -> None:
+    global worker_engine, worker_table
+    worker_table = TranspositionTable(hash_size) if hash_size > 0 else None
+    worker_engine = Engine(Board(), table=worker_table)
+
+def analyse_chunk(chunk: list[tuple[int, str | bytes]], mode: str, depth: int = None, time_limit: float = None) -> str:
+    # the whole chunk comes back as JSONL text, cheaper to send between processes than a list of dicts
+    return ''.join(json.dumps(analyse_position(line_number, line, mode, depth, time_limit)) + '\n' for line_number, line in chunk)
+
+def analyse_position(line_number: int, line: str | bytes, mode: str, depth: int = None, time_limit: float = None) -> dict:
+    # line is a FEN or EPD line, or a binary position record which skips FEN parsing altogether
+    # -> records are only known by their number, writing their FEN back out would cost more than decoding them saves
+    record = {"line": line_number}
+    try:
+        if isinstance(line, bytes):
+            engine = load_record(line)
+            epd_operations = {}
+        else:
+            fen_string, epd_operations = parse_position(line)
+            engine = load_position(fen_string)
+            record["fen"] = fen_string
+    # FENError and RecordError are ValueErrors too
+    except ValueError as error:
+        record["error"] = str(error)
+        return record
+
+    if "id" in epd_operations:
+        record["id"] = epd_operations["id"]
+
+    match mode:
+        case "moves":
+            in_check, legal_moves = engine.generate_legal_moves()
+            record["moves"] = len(legal_moves)
+            record["in_check"] = in_check
+        case "perft":
+            record["depth"] = depth
+            record["nodes"] = engine.perft(depth, worker_table)
+            # perft suites list expected counts as D1, D2, ...
+            expected_nodes = epd_operations.get(f"D{depth}")
+            if expected_nodes is not None and expected_nodes.isdigit():
+                record["expected"] = int(expected_nodes)
+                record["correct"] = record["nodes"] == record["expected"]
+        case "search":
+            if engine.table is not None:
+                engine.table.clear()
+            engine.ordering = MoveOrdering()
+            result = engine.search(depth, time_limit)
+            record["move"] = None if result.best_move is None else get_move_notation(result.best_move)
+            record["score"] = result.score
+            record["depth"] = result.depth
+            record["pv"] = [get_move_notation(move) for move in result.principal_variation]
+            record["nodes"] = result.nodes
+
+    return record
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Square index = y*8 + x, so bit 0 is a8 (top left) and bit 63 is h1 (bottom right)
+FULL = (1 << 64) - 1
+
+FILE_A = 0x0101010101010101
+FILE_B = FILE_A << 1
+FILE_G = FILE_A << 6
+FILE_H = FILE_A << 7
+
+# a8 is a light square -> light squares are the ones where x + y is even
+LIGHT_SQUARES = sum(1 << (y*8 + x) for y in range(8) for x in range(8) if (x + y) % 2 == 0)
+DARK_SQUARES = FULL ^ LIGHT_SQUARES
+
+# masks clearing squares that wrapped around to the other side of the board after a sideways shift
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+NOT_FILE_AB = FULL ^ (FILE_A | FILE_B)
+NOT_FILE_GH = FULL ^ (FILE_G | FILE_H)
+
+# (shift amount, wrap mask) -> positive shifts move down the board (towards rank 1)
+BISHOP_DIRECTIONS = ((-9, NOT_FILE_H), (-7, NOT_FILE_A), (7, NOT_FILE_H), (9, NOT_FILE_A))
+ROOK_DIRECTIONS = ((-8, FULL), (-1, NOT_FILE_H), (1, NOT_FILE_A), (8, FULL))
+QUEEN_DIRECTIONS = BISHOP_DIRECTIONS + ROOK_DIRECTIONS
+
+
+def get_rank(y: int) -> int:
+    return 0xFF << (y*8)
+
+def get_knight_attacks(bitboard: int) -> int:
+    one_left = (bitboard >> 1) & NOT_FILE_H
+    two_left = (bitboard >> 2) & NOT_FILE_GH
+    one_right = (bitboard << 1) & NOT_FILE_A
+    two_right = (bitboard << 2) & NOT_FILE_AB
+    one_sideways = one_left | one_right
+    two_sideways = two_left | two_right
+    return ((one_sideways << 16) | (one_sideways >> 16) | (two_sideways << 8) | (two_sideways >> 8)) & FULL
+
+def get_king_attacks(bitboard: int) -> int:
+    attacks = ((bitboard << 1) & NOT_FILE_A) | ((bitboard >> 1) & NOT_FILE_H)
+    row = attacks | bitboard
+    return (attacks | (row << 8) | (row >> 8)) & FULL
+
+def get_pawn_attacks(bitboard: int, colour: int) -> int:
+    # white pawns attack up the board, black pawns down
+    if colour == 0:
+        return ((bitboard >> 9) & NOT_FILE_H) | ((bitboard >> 7) & NOT_FILE_A)
+    return ((bitboard << 7) & NOT_FILE_H) | ((bitboard << 9) & NOT_FILE_A)
+
+def get_ray(square: int, amount: int, mask: int) -> int:
+    ray = 0
+    square_bit = 1 << square
+    while True:
+        square_bit = (square_bit << amount if amount > 0 else square_bit >> -amount) & mask
+        if not square_bit:
+            return ray
+        ray |= square_bit
+
+def get_sliding_attacks(square: int, rays: tuple[tuple], occupied: int) -> int:
+    attacks = 0
+    for ray_table, is_positive in rays:
+        ray = ray_table[square]
+        blockers = ray & occupied
+        if blockers:
+            # nearest blocker is the lowest bit on rays heading down the board and the highest heading up
+            if is_positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            # cut the ray off behind the blocker, which stays in as a possible capture
+            ray ^= ray_table[blocker]
+        attacks |= ray
+    return attacks
+
+def is_ray_attacked(square: int, rays: tuple[tuple], occupied: int, attackers: int) -> bool:
+    if not attackers:
+        return False
+    for ray_table, is_positive in rays:
+        blockers = ray_table[square] & occupied
+        if not blockers:
+            continue
+        # only the nearest piece on each ray can be attacking the square
+        if is_positive:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        if attackers >> blocker & 1:
+            return True
+    return False
+
+def get_pinned(square: int, rays: tuple[tuple], occupied: int, own: int, attackers: int) -> int:
+    pinned = 0
+    if not attackers:
+        return pinned
+    for ray_table, is_positive in rays:
+        # a pinned piece is the nearest piece on a ray and one of ours, with an attacker directly behind it
+        blockers = ray_table[square] & occupied
+        if not blockers:
+            continue
+        first_blocker = get_nearest_square(blockers, is_positive)
+        if not own >> first_blocker & 1:
+            continue
+        blockers ^= 1 << first_blocker
+        if blockers and attackers >> get_nearest_square(blockers, is_positive) & 1:
+            pinned |= 1 << first_blocker
+    return pinned
+
+def get_nearest_square(blockers: int, is_positive: bool) -> int:
+    if is_positive:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+def get_squares(bitboard: int) -> list[int]:
+    squares = []
+    while bitboard:
+        least_significant_bit = bitboard & -bitboard
+        squares.append(least_significant_bit.bit_length() - 1)
+        bitboard ^= least_significant_bit
+    return squares
+
+
+# Attack tables for every square, built once on import
+KNIGHT_ATTACKS = [get_knight_attacks(1 << square) for square in range(64)]
+KING_ATTACKS = [get_king_attacks(1 << square) for square in range(64)]
+PAWN_ATTACKS = [[get_pawn_attacks(1 << square, colour) for square in range(64)] for colour in (0, 1)]
+
+RAYS = {amount: [get_ray(square, amount, mask) for square in range(64)] for amount, mask in QUEEN_DIRECTIONS}
+BISHOP_RAYS = tuple((RAYS[amount], amount > 0) for amount, mask in BISHOP_DIRECTIONS)
+ROOK_RAYS = tuple((RAYS[amount], amount > 0) for amount, mask in ROOK_DIRECTIONS)
+QUEEN_RAYS = BISHOP_RAYS + ROOK_RAYS
+
+# BETWEEN[a][b] = squares strictly between a and b, LINE[a][b] = whole board line through both (empty if not aligned)
+BETWEEN = [[0]*64 for square in range(64)]
+LINE = [[0]*64 for square in range(64)]
+for amount, mask in QUEEN_DIRECTIONS:
+    for square in range(64):
+        for target in get_squares(RAYS[amount][square]):
+            BETWEEN[square][target] = RAYS[amount][square] & RAYS[-amount][target]
+            LINE[square][target] = RAYS[amount][square] | RAYS[-amount][square] | 1 << square
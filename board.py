@@ -2,10 +2,13 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from pieces import Piece
-from constants import Colour, PieceType, MoveType, BOARD_WIDTH, BOARD_HEIGHT, PIECE_TO_STRING, STRING_TO_PIECE, RANKS, FILES
+from constants import Colour, PieceType, BOARD_WIDTH, BOARD_HEIGHT
+from fen import FENPosition, parse_FEN, format_FEN
+from zobrist import PIECE_KEYS, CASTLING_KEYS, ENPASSANT_KEYS, TURN_KEY
+from bitboards import PAWN_ATTACKS, LIGHT_SQUARES, DARK_SQUARES
 
 if TYPE_CHECKING:
-    from pieces import Piece, Move
+    from pieces import Piece
 
 
 class Board:
@@ -15,38 +18,53 @@ class Board:
 
         self.pieces = {Colour.WHITE:[], Colour.BLACK:[]}
         self.board = self.create_empty_board()
+        self.bitboards = self.create_empty_bitboards()
+        self.occupancy = [0, 0]
 
         self.current_turn = Colour.WHITE
         self.opponent_turn = Colour.BLACK
         self.enpassant_target = (-1,-1,None)
+        # the part of the hash the en passant target adds, see get_enpassant_key
+        self.enpassant_key = 0
         self.castling_rights = {Colour.WHITE:[False,False], Colour.BLACK:[False,False]}
         self.half_moves = 0
         self.full_moves = 1
 
+        # zobrist key of the position, kept up to date as pieces and state change
+        self.hash = 0
+        # keys of the positions before each move made since the board was loaded, the last one is the position a ply ago
+        self.hash_stack = []
+
     def create_empty_board(self) -> list[None]:
-        return [[None for x in range(self.width)] for y in range(self.height)]
-
-    def place_initial_piece(self, piece_type: PieceType, colour: Colour, x: int, y: int) -> None:
-        if not self.inside_board(x, y):
-            print(f"Error: {piece_type.name} cannot be placed outside board.")
-            return
-        elif self.get_piece(x, y) is not None:
-            print(f"Error: {piece_type.name} cannot be placed ontop of another piece.")
-            return
-
-        new_piece = Piece(piece_type, colour, x, y, True)
-        if new_piece.piece_type == PieceType.KING:
-            self.pieces[colour].insert(0, new_piece)
-        else:
-            self.pieces[colour].append(new_piece)
+        # square -> piece lookup, bitboards hold the positions used for move generation
+        return [None for square in range(self.width*self.height)]
 
-        self.set_piece(x, y, new_piece)
+    def create_empty_bitboards(self) -> list[list[int]]:
+        # one bitboard per colour and piece type -> bitboards[colour][piece_type]
+        return [[0 for piece_type in PieceType] for colour in Colour]
 
     def get_piece(self, x: int, y: int) -> Piece:
-        return self.board[y][x]
+        return self.board[y*self.width + x]
 
     def set_piece(self, x: int, y: int, piece: Piece) -> None:
-        self.board[y][x] = piece
+        square = y*self.width + x
+        square_bit = 1 << square
+
+        old_piece = self.board[square]
+        if old_piece is not None:
+            self.bitboards[old_piece.colour][old_piece.piece_type] ^= square_bit
+            self.occupancy[old_piece.colour] ^= square_bit
+            self.hash ^= PIECE_KEYS[old_piece.colour][old_piece.piece_type][square]
+
+        if piece is not None:
+            self.bitboards[piece.colour][piece.piece_type] |= square_bit
+            self.occupancy[piece.colour] |= square_bit
+            self.hash ^= PIECE_KEYS[piece.colour][piece.piece_type][square]
+
+        self.board[square] = piece
+
+    def get_occupied(self) -> int:
+        return self.occupancy[Colour.WHITE] | self.occupancy[Colour.BLACK]
 
     def inside_board(self, x: int, y: int) -> bool:
         return x >= 0 and x < self.width and y >= 0 and y < self.height
@@ -58,142 +76,137 @@ class Board:
     def switch_turn(self) -> None:
         self.opponent_turn = self.current_turn
         self.current_turn = self.get_other_turn(self.current_turn)
+        self.hash ^= TURN_KEY
+
+    def set_enpassant_target(self, x: int, y: int, target: Piece) -> None:
+        self.hash ^= self.enpassant_key
+        self.enpassant_key = self.get_enpassant_key(x, y, target)
+        self.hash ^= self.enpassant_key
+        self.enpassant_target = (x,y,target)
+
+    def get_enpassant_key(self, x: int, y: int, target: Piece) -> int:
+        # the file only goes into the hash when an enemy pawn stands beside the pawn that moved two squares,
+        # otherwise the position repeats one that's the same apart from a capture nobody can make
+        if target is not None and PAWN_ATTACKS[target.colour][y*self.width + x] & self.bitboards[target.colour ^ 1][PieceType.PAWN]:
+            return ENPASSANT_KEYS[x]
+        return 0
+
+    def remove_castling_right(self, colour: Colour, side: int) -> None:
+        if self.castling_rights[colour][side]:
+            self.castling_rights[colour][side] = False
+            self.hash ^= CASTLING_KEYS[colour][side]
+
+    def get_hash(self) -> int:
+        # full recompute -> the incrementally updated self.hash should always match this
+        key = 0
+        for square, piece in enumerate(self.board):
+            if piece is not None:
+                key ^= PIECE_KEYS[piece.colour][piece.piece_type][square]
+
+        if self.current_turn == Colour.BLACK:
+            key ^= TURN_KEY
+
+        for colour in Colour:
+            for side in range(2):
+                if self.castling_rights[colour][side]:
+                    key ^= CASTLING_KEYS[colour][side]
+
+        key ^= self.get_enpassant_key(*self.enpassant_target)
+
+        return key
 
     def update_full_moves(self) -> None:
         if self.current_turn == Colour.BLACK:
             self.full_moves += 1
 
-    def update_half_moves(self, move: Move) -> None:
-        if move.piece.piece_type == PieceType.PAWN or move.move_type == MoveType.CAPTURE:
+    def update_half_moves(self, piece_type: PieceType, captured: Piece) -> None:
+        # plies since the last pawn move or capture -> counts both sides' moves
+        if piece_type == PieceType.PAWN or captured is not None:
             self.half_moves = 0
-        elif self.current_turn == Colour.BLACK:
+        else:
             self.half_moves += 1
 
-    def load_FEN(self, fen_string: str) -> None:
-        self.pieces = {Colour.WHITE:[], Colour.BLACK:[]}
-        self.board = self.create_empty_board()
-        self.current_turn = Colour.WHITE
-        self.opponent_turn = Colour.BLACK
-        self.enpassant_target = (-1,-1,None)
-        self.castling_rights = {Colour.WHITE:[False,False], Colour.BLACK:[False,False]}
-        self.half_moves = 0
-        self.full_moves = 1
+    def count_repetitions(self, limit: int = None) -> int:
+        # earlier occurrences of this position, counting stops at limit if given
+        # only positions since the last pawn move or capture can match and only every other ply has the same side to move, the closest being four plies back
+        stack = self.hash_stack
+        count = 0
+        for index in range(len(stack)-4, len(stack)-1-min(self.half_moves, len(stack)), -2):
+            if stack[index] == self.hash:
+                count += 1
+                if count == limit:
+                    break
+        return count
+
+    def is_repetition(self) -> bool:
+        # one earlier occurrence is enough for search to call the position a draw
+        return self.count_repetitions(1) > 0
+
+    def is_insufficient_material(self) -> bool:
+        # no sequence of legal moves can mate -> lone kings, a single minor piece, or only bishops all on one square colour
+        white, black = self.bitboards
+        if (white[PieceType.PAWN] | white[PieceType.ROOK] | white[PieceType.QUEEN] |
+            black[PieceType.PAWN] | black[PieceType.ROOK] | black[PieceType.QUEEN]):
+            return False
+        knights = white[PieceType.KNIGHT] | black[PieceType.KNIGHT]
+        bishops = white[PieceType.BISHOP] | black[PieceType.BISHOP]
+        if not knights:
+            return not bishops & LIGHT_SQUARES or not bishops & DARK_SQUARES
+        return not bishops and knights & (knights-1) == 0
 
-        try:
-            board, turn, castling, en_passant, half_moves, full_moves = fen_string.split(' ')
-        except:
-            print('Error: Invalid FEN string')
-            return
-
-        x = 0
-        y = 0
-        for char in board:
-            if char == '/':
-                y += 1
-                x = 0
-            elif char.lower() in STRING_TO_PIECE:
-                # place piece
-                piece_type = STRING_TO_PIECE[char.lower()]
-                colour = Colour.WHITE if char.isupper() else Colour.BLACK
-                self.place_initial_piece(piece_type, colour, x, y)
-
-                x += 1
-            else:
-                # number to skip
-                x += int(char)
-
-        # Set turn
-        if turn == 'w':
-            self.current_turn = Colour.WHITE
-            self.opponent_turn = Colour.BLACK
-        else:
-            self.current_turn = Colour.BLACK
-            self.opponent_turn = Colour.WHITE
-
-        # Set Castling
-        # TODO say in invalid fen string -> king moved, rook not there
-        for char in castling:
-            if char == 'K':
-                self.castling_rights[Colour.WHITE][0] = True
-            if char == 'Q':
-                self.castling_rights[Colour.WHITE][1] = True
-            if char == 'k':
-                self.castling_rights[Colour.BLACK][0] = True
-            if char == 'q':
-                self.castling_rights[Colour.BLACK][1] = True
-
-        # Set en_passant
-        # TODO: Say if invalid -> target pawn not in spot supposed to be
-        x = -1
-        y = -1
-        for char in en_passant:
-            if char in RANKS:
-                x = RANKS.index(char)
-            elif char in FILES:
-                y = 8 - int(char)
-
-        if x != -1 and y != -1:
-            direction = 1 if self.current_turn == Colour.WHITE else -1
-            target = self.get_piece(x, y+direction)
-            self.enpassant_target = (x,y,target)
-
-        self.half_moves = int(half_moves)
-        self.full_moves = int(full_moves)
+    def load_FEN(self, fen_string: str) -> None:
+        # the whole string is checked first -> raises FENError and leaves the board as it was if anything is wrong
+        self.load_position(parse_FEN(fen_string))
+
+    def load_position(self, position: FENPosition) -> None:
+        # position has to be valid already, e.g. from parse_FEN or a binary position record
+        pieces = ([], [])
+        board = [None] * (self.width*self.height)
+        bitboards = [[0]*len(PieceType), [0]*len(PieceType)]
+        occupancy = [0, 0]
+
+        key = 0
+        width = self.width
+        for square, colour, piece_type in position.pieces:
+            piece = Piece(piece_type, colour, square % width, square // width, True)
+            pieces[colour].append(piece)
+            board[square] = piece
+            bitboards[colour][piece_type] |= 1 << square
+            occupancy[colour] |= 1 << square
+            key ^= PIECE_KEYS[colour][piece_type][square]
+
+        self.pieces = {Colour.WHITE:pieces[Colour.WHITE], Colour.BLACK:pieces[Colour.BLACK]}
+        self.board = board
+        self.bitboards = bitboards
+        self.occupancy = occupancy
+
+        self.current_turn = position.turn
+        self.opponent_turn = self.get_other_turn(position.turn)
+        if position.turn == Colour.BLACK:
+            key ^= TURN_KEY
+
+        white_rights, black_rights = position.castling_rights
+        self.castling_rights = {Colour.WHITE:list(white_rights), Colour.BLACK:list(black_rights)}
+        for side in range(2):
+            if white_rights[side]:
+                key ^= CASTLING_KEYS[Colour.WHITE][side]
+            if black_rights[side]:
+                key ^= CASTLING_KEYS[Colour.BLACK][side]
 
-    def get_FEN(self) -> str:
-        fen = ""
-
-        # Board
-        empty_count = 0
-        for y in range(self.height):
-            for x in range(self.width):
-                piece = self.get_piece(x, y)
-                if piece is None:
-                    empty_count += 1
-                else:
-                    if empty_count > 0:
-                        fen += str(empty_count)
-                        empty_count = 0
-                    notation = PIECE_TO_STRING[piece.piece_type]
-                    if piece.colour == Colour.WHITE:
-                        notation = notation.upper()
-                    fen += notation
-            if empty_count > 0:
-                fen += str(empty_count)
-                empty_count = 0
-            if y < self.height - 1:
-                fen +=  '/'
-
-        # Turn
-        turn = 'w' if self.current_turn == Colour.WHITE else 'b'
-        fen += f" {turn}"
-
-        # Castling
-        castling = ""
-        if self.castling_rights[Colour.WHITE][0]:
-            castling += 'K'
-        if self.castling_rights[Colour.WHITE][1]:
-            castling += 'Q'
-        if self.castling_rights[Colour.BLACK][0]:
-            castling += 'k'
-        if self.castling_rights[Colour.BLACK][0]:
-            castling += 'q'
-        if castling == "":
-            castling = '-'
-
-        fen += f" {castling}"
-
-        # En_passant target
-        en_passant = ""
-        if self.enpassant_target[2] is None:
-            en_passant = "-"
-        else:
-            en_passant += RANKS[self.enpassant_target[0]]
-            en_passant += str(self.height-self.enpassant_target[1])
+        self.enpassant_target = (-1,-1,None)
+        if position.enpassant_target is not None:
+            x, y = position.enpassant_target
+            direction = 1 if position.turn == Colour.WHITE else -1
+            self.enpassant_target = (x, y, self.get_piece(x, y+direction))
+        self.enpassant_key = self.get_enpassant_key(*self.enpassant_target)
+        key ^= self.enpassant_key
 
-        fen += f" {en_passant}"
+        self.half_moves = position.half_moves
+        self.full_moves = position.full_moves
 
-        fen += f" {self.half_moves}"
-        fen += f" {self.full_moves}"
+        self.hash = key
+        # nothing before the loaded position is known, callers with a game history put its keys back
+        self.hash_stack = []
 
-        return fen
+    def get_FEN(self) -> str:
+        return format_FEN(self)
@@ -1,9 +1,7 @@
-import pygame
-
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 from string import ascii_letters
 
-pygame.init()
+# the rules and engine never touch pygame -> anything that needs a display lives in setup.py
 
 # Don't change board size
 BOARD_WIDTH = 8
@@ -11,25 +9,22 @@ BOARD_HEIGHT = 8
 RANKS = [ascii_letters[i] for i in range(BOARD_WIDTH)]
 FILES = [str(i) for i in range(BOARD_HEIGHT,0,-1)]
 
-# Pygame Constants
-SCREEN = pygame.display.Info()
-SQUARE_SIZE = (min(SCREEN.current_w, SCREEN.current_h) - 100) // max(BOARD_WIDTH, BOARD_HEIGHT)
-FPS = 0
-WINDOW_RESOLUTION = (BOARD_WIDTH*SQUARE_SIZE, BOARD_HEIGHT*SQUARE_SIZE)
-WINDOW_CAPTION = "CHESS"
-
-# Asset constants
-FONT_SIZE = SQUARE_SIZE//4
-FONT_COLOUR = (255,255,255)
-TEXT_OFFSET = SQUARE_SIZE//FONT_SIZE
-
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 LOAD_FILE = "games/load.txt"
+# plies without a pawn move or capture before the game is drawn -> fifty moves by each side
+FIFTY_MOVE_PLIES = 100
+
+# positions whose legal moves the game keeps around for scrubbing through history
+MOVE_CACHE_SIZE = 1024
+# plies between full position snapshots in a game's history -> jumping anywhere replays at most this many moves
+SNAPSHOT_INTERVAL = 16
 
-class Colour(Enum):
-    WHITE = auto()
+# IntEnums so colours and piece types can index bitboard lists directly and move types pack into ints
+class Colour(IntEnum):
+    WHITE = 0
     BLACK = auto()
 
-class PieceType(Enum):
+class PieceType(IntEnum):
     PAWN = 0
     KNIGHT = auto()
     BISHOP = auto()
@@ -37,7 +32,7 @@ class PieceType(Enum):
     QUEEN = auto()
     KING = auto()
 
-class MoveType(Enum):
+class MoveType(IntEnum):
     MOVE = 0
     CAPTURE = auto()
     DOUBLE_PUSH = auto()
@@ -51,15 +46,24 @@ class GameStates(Enum):
     CHECK = auto()
     STALEMATE = auto()
     CHECKMATE = auto()
+    DRAW = auto()
 
-# PIECE_VALUES = {
-#     PieceType.PAWN: 1,
-#     PieceType.KNIGHT: 3,
-#     PieceType.BISHOP: 3,
-#     PieceType.ROOK: 5,
-#     PieceType.QUEEN: 9,
-#     PieceType.KING: 999
-# }
+# Centipawns
+PIECE_VALUES = {
+    PieceType.PAWN: 100,
+    PieceType.KNIGHT: 320,
+    PieceType.BISHOP: 330,
+    PieceType.ROOK: 500,
+    PieceType.QUEEN: 900,
+    PieceType.KING: 20000
+}
+
+# Search constants
+MATE_SCORE = 100000
+MAX_PLY = 64
+# no legal position has more than 218 moves
+MAX_MOVES = 256
+SEARCH_TIME_LIMIT = 1.0
 
 PIECE_TO_STRING = {
     PieceType.PAWN: 'p',
@@ -78,3 +82,12 @@ STRING_TO_PIECE = {
     'q' : PieceType.QUEEN,
     'k' : PieceType.KING
 }
+
+class Bound(IntEnum):
+    EXACT = 0
+    LOWER = auto()
+    UPPER = auto()
+
+class Replacement(Enum):
+    DEPTH_PREFERRED = auto()
+    ALWAYS = auto()
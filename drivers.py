@@ -1,12 +1,52 @@
+import argparse
+from time import perf_counter
+
 from board import Board
-from engine import Engine
+from engine import Engine, SearchResult
+from pieces import get_move_notation
+from transposition import TranspositionTable
+from parallel import parallel_divide, parallel_search
+
+# https://www.chessprogramming.org/Perft_Results -> node counts for depths 1 to 5
+PERFT_POSITIONS = [
+    ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", (20, 400, 8902, 197281, 4865609)),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0", (48, 2039, 97862, 4085603, 193690690)),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0", (14, 191, 2812, 43238, 674624)),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", (44, 1486, 62379, 2103487, 89941194)),
+    ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", (46, 2079, 89890, 3894594, 164075551)),
+]
 
 def main():
+    parser = argparse.ArgumentParser(description="Move generator accuracy and perft benchmarks")
+    parser.add_argument("depth", nargs="?", type=int, default=3, help="perft depth for the benchmark positions (1-5)")
+    parser.add_argument("--divide", metavar="FEN", help="print a per root move breakdown for a position instead")
+    parser.add_argument("--debug", action="store_true", help="cross check zobrist keys against a full recompute at every node")
+    parser.add_argument("--hash", type=int, default=0, metavar="MB", help="cache subtree counts in a transposition table of this size")
+    parser.add_argument("--search", action="store_true", help="time searches of the benchmark positions to the given depth instead")
+    parser.add_argument("--workers", type=int, default=0, metavar="N", help="split the work over N processes (each with its own --hash table)")
+    parser.add_argument("--lazy", action="store_true", help="with --workers, search the whole position in every process instead of splitting root moves")
+    args = parser.parse_args()
+
+    table = TranspositionTable(args.hash) if args.hash > 0 else None
+
+    if args.search:
+        if args.workers:
+            parallel_search_benchmark(args.depth, args.workers, args.lazy, args.hash or 16)
+        else:
+            search_benchmark(args.depth, table)
+        return
+
+    if args.divide is not None:
+        if args.workers:
+            parallel_divide_benchmark(args.divide, args.depth, args.workers, args.hash)
+        else:
+            divide(args.divide, args.depth, args.debug, table)
+        return
+
     # https://www.chessprogramming.org/Perft_Results#Initial_Position -> depth of 1
     debug_accuracy("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", 20)
     debug_accuracy("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 0", 48)
     debug_accuracy("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 0", 14)
-    # Innacurate due to promotion only to queen -> off by three due to underpromotion to knight, bishop and rook
     debug_accuracy("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", 44)
     debug_accuracy("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", 46)
 
@@ -17,9 +57,11 @@ def main():
     debug_accuracy("r3k2r/p1pp1pb1/bn2Qnp1/2qPN3/1p2P3/2N5/PPPBBPPP/R3K2R b KQkq - 3 2", 5)
     debug_accuracy("2kr3r/p1ppqpb1/bn2Qnp1/3PN3/1p2P3/2N5/PPPBBPPP/R3K2R b KQ - 3 2", 44)
     debug_accuracy("rnb2k1r/pp1Pbppp/2p5/q7/2B5/8/PPPQNnPP/RNB1K2R w KQ - 3 9", 39)
-    # Innacurate due to promotion only to queen -> off by six due to underpromotion to knight, bishop and rook as pawn can promote 2 ways
     debug_accuracy("2r5/3pk3/8/2P5/8/2K5/8/8 w - - 5 4", 9)
 
+    if not perft_suite(args.depth, args.debug, table, args.workers, args.hash):
+        raise SystemExit(1)
+
 
 def debug_accuracy(fen_string: str, legal_moves: int) -> None:
     print()
@@ -31,17 +73,122 @@ def debug_accuracy(fen_string: str, legal_moves: int) -> None:
 def number_of_moves(fen_string: str) -> int:
     board = Board()
     board.load_FEN(fen_string)
-    engine = Engine(board)
+    return len(get_legal_moves(Engine(board)))
+
+def get_legal_moves(engine: Engine) -> list[int]:
+    in_check, legal_moves = engine.generate_legal_moves()
+    return legal_moves
+
+def perft(board: Board, depth: int, debug: bool = False, table: TranspositionTable = None) -> int:
+    return Engine(board, debug).perft(depth, table)
+
+def divide(fen_string: str, depth: int, debug: bool = False, table: TranspositionTable = None) -> dict[str, int]:
+    board = Board()
+    board.load_FEN(fen_string)
+    engine = Engine(board, debug)
+
+    start_time = perf_counter()
+    breakdown = {}
+    for move in get_legal_moves(engine):
+        previous_state = engine.make_move(move)
+        breakdown[get_move_notation(move)] = engine.perft(depth-1, table)
+        engine.unmake_move(move, previous_state)
+    elapsed_time = perf_counter() - start_time
+
+    print_divide(fen_string, breakdown, elapsed_time)
+    return breakdown
+
+def print_divide(fen_string: str, breakdown: dict[str, int], elapsed_time: float) -> None:
+    print()
+    print(fen_string)
+    for notation, nodes in breakdown.items():
+        print(f"{notation}: {nodes}")
+    print_results(sum(breakdown.values()), elapsed_time)
+
+def parallel_divide_benchmark(fen_string: str, depth: int, workers: int, hash_size: int = 0) -> dict[str, int]:
+    start_time = perf_counter()
+    breakdown = parallel_divide(fen_string, depth, workers, hash_size)
+    elapsed_time = perf_counter() - start_time
 
-    current_turn_pieces = board.pieces[board.current_turn]
-    opponent_pieces = board.pieces[board.opponent_turn]
+    print_divide(fen_string, breakdown, elapsed_time)
+    return breakdown
 
-    in_check = engine.is_attacked(current_turn_pieces[0].x, current_turn_pieces[0].y, opponent_pieces)
+def perft_suite(depth: int, debug: bool = False, table: TranspositionTable = None, workers: int = 0, hash_size: int = 0) -> bool:
+    total_nodes = 0
+    total_time = 0
+    passed = 0
+
+    for fen_string, expected_nodes in PERFT_POSITIONS:
+        board = Board()
+        board.load_FEN(fen_string)
+
+        start_time = perf_counter()
+        if workers:
+            # root moves are counted in separate processes -> no debug hashing or shared table
+            nodes = sum(parallel_divide(fen_string, depth, workers, hash_size).values())
+        else:
+            nodes = perft(board, depth, debug, table)
+        elapsed_time = perf_counter() - start_time
+
+        total_nodes += nodes
+        total_time += elapsed_time
+        passed += nodes == expected_nodes[depth-1]
+
+        print()
+        print(f"{fen_string} (depth {depth})")
+        print(f"expected: {expected_nodes[depth-1]}, output: {nodes}")
+        print(f"correct: {nodes == expected_nodes[depth-1]}")
+        print_results(nodes, elapsed_time)
+
+    print()
+    print(f"passed: {passed}/{len(PERFT_POSITIONS)}")
+    print_results(total_nodes, total_time)
+
+    return passed == len(PERFT_POSITIONS)
+
+def search_benchmark(depth: int, table: TranspositionTable = None) -> None:
+    total_nodes = 0
+    total_time = 0
+
+    for fen_string, expected_nodes in PERFT_POSITIONS:
+        board = Board()
+        board.load_FEN(fen_string)
+        if table is not None:
+            table.clear()
+
+        print()
+        print(fen_string)
+        result = Engine(board, table=table).search(depth, report=print_iteration)
+
+        total_nodes += result.nodes
+        total_time += result.time
+
+    print()
+    print_results(total_nodes, total_time)
+
+def parallel_search_benchmark(depth: int, workers: int, lazy: bool = False, hash_size: int = 16) -> None:
+    total_nodes = 0
+    total_time = 0
+
+    for fen_string, expected_nodes in PERFT_POSITIONS:
+        print()
+        print(fen_string)
+        result = parallel_search(fen_string, depth, workers=workers, lazy=lazy, hash_size=hash_size)
+        print_iteration(result)
+
+        total_nodes += result.nodes
+        total_time += result.time
+
+    print()
+    print_results(total_nodes, total_time)
 
-    pseudo_legal_moves = engine.get_pseudo_legal_moves(current_turn_pieces)
-    legal_moves = engine.get_legal_moves(in_check, pseudo_legal_moves, current_turn_pieces[0], opponent_pieces)
+def print_iteration(result: SearchResult) -> None:
+    principal_variation = ' '.join(get_move_notation(move) for move in result.principal_variation)
+    print(f"depth: {result.depth}, score: {result.score}, nodes: {result.nodes}, time: {result.time:.3f}s, "
+          f"nps: {int(result.nodes / max(result.time, 1e-9))}, first move cutoffs: {result.first_move_cutoff_rate:.0%}, pv: {principal_variation}")
 
-    return len(legal_moves)
+def print_results(nodes: int, elapsed_time: float) -> None:
+    print(f"nodes: {nodes}, time: {elapsed_time:.3f}s, nps: {int(nodes / max(elapsed_time, 1e-9))}")
 
 if __name__ == "__main__":
     main()
@@ -1,55 +1,151 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
+from dataclasses import dataclass, field
+from time import perf_counter
 
-from constants import Colour, PieceType, MoveType, GameStates
-from pieces import get_moves
+from constants import Colour, PieceType, GameStates, Bound, PIECE_VALUES, MATE_SCORE, MAX_PLY, FIFTY_MOVE_PLIES
+from pieces import (SQUARE_MASK, TO_SHIFT, PROMOTION_SHIFT, TYPE_FIELD, DOUBLE_PUSH_FLAG, EN_PASSANT_FLAG, PROMOTION_FLAG,
+                    CASTLE_QUEEN_SIDE_FLAG, CASTLE_KING_SIDE_FLAG, get_moves, get_king_moves, create_move_buffer, is_quiet, is_underpromotion)
+from fen import CASTLING_SQUARES
+from evaluation import evaluate
+from transposition import TranspositionTable
+from ordering import MoveOrdering
+from bitboards import FULL, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BISHOP_RAYS, ROOK_RAYS, BETWEEN, LINE, get_sliding_attacks, is_ray_attacked, get_pinned, get_rank
 
 if TYPE_CHECKING:
+    from array import array
     from board import Board
-    from pieces import Move, Piece
+    from pieces import Piece
+
+
+@dataclass (slots=True)
+class SearchResult:
+    # moves are packed ints, see pieces.decode_move
+    best_move: int
+    score: int
+    depth: int
+    principal_variation: list[int] = field(default_factory=list)
+    nodes: int = 0
+    time: float = 0
+    first_move_cutoff_rate: float = 0
 
 
 class Engine:
-    def __init__(self, board: Board) -> None:
+    def __init__(self, board: Board, debug: bool = False, table: TranspositionTable = None) -> None:
         self.board = board
+        # cross checks the incremental zobrist key against a full recompute after every make and unmake
+        self.debug = debug
+
+        # search state -> table is only allocated once a search is run
+        self.table = table
+        self.ordering = MoveOrdering()
+        self.nodes = 0
+        self.deadline = None
+        self.stopped = False
+        self.insufficient_material = False
+        self.principal_variations = [[] for ply in range(MAX_PLY+1)]
+        # one move buffer per ply (or per remaining depth in perft) -> generating moves allocates nothing new
+        self.move_buffers = [create_move_buffer() for ply in range(MAX_PLY+1)]
+
+    def generate_legal_moves(self, targets: int = FULL) -> tuple[bool, list[int]]:
+        # targets limits which squares moves may land on -> e.g. only enemy pieces for captures
+        moves = create_move_buffer()
+        in_check, count = self.generate_moves(moves, targets)
+        return in_check, moves[:count].tolist()
+
+    def generate_moves(self, moves: array, targets: int = FULL) -> tuple[bool, int]:
+        # writes the legal moves into the buffer and returns how many there are
+        current_turn_pieces = self.board.pieces[self.board.current_turn]
+        king = current_turn_pieces[0]
+        king_square = king.y*self.board.width + king.x
+        occupied = self.board.get_occupied()
+
+        checkers = self.get_attackers(king_square, self.board.opponent_turn, occupied)
+        in_check = checkers != 0
+
+        count = self.get_king_legal_moves(king, in_check, occupied, moves, targets)
 
-    def get_pseudo_legal_moves(self, current_turn_pieces: list[Piece]) -> list[Move]:
-        pseudo_legal_moves = []
+        # double check -> only the king can move
+        if checkers & (checkers - 1):
+            return in_check, count
 
-        for piece in current_turn_pieces:
+        # in check -> other pieces must capture the checker or block between it and the king
+        check_mask = targets
+        if in_check:
+            checker_square = checkers.bit_length() - 1
+            check_mask &= checkers | BETWEEN[king_square][checker_square]
+
+        pinned = self.get_pinned(king_square, self.board.current_turn, occupied)
+
+        for piece in current_turn_pieces[1:]:
             if not piece.alive:
                 continue
-            pseudo_legal_moves += get_moves(self.board, piece)
+            square = piece.y*self.board.width + piece.x
+            allowed = check_mask
+            # pinned pieces can only move along the line through the king
+            if pinned >> square & 1:
+                allowed &= LINE[king_square][square]
+            count = get_moves(self.board, piece, moves, count, allowed)
 
-        return pseudo_legal_moves
+        # drop illegal en passant captures by shuffling the rest down the buffer
+        if self.board.enpassant_target[2] is not None:
+            legal_count = 0
+            for index in range(count):
+                move = moves[index]
+                if move & TYPE_FIELD != EN_PASSANT_FLAG or self.is_enpassant_legal(move, king_square, occupied):
+                    moves[legal_count] = move
+                    legal_count += 1
+            count = legal_count
 
-    def get_legal_moves(self, in_check: bool, pseudo_legal_moves: list[Move], current_turn_king: Piece, opponent_pieces: list[Piece]) -> list[Move]:
-        legal_moves = []
+        return in_check, count
+
+    def get_king_legal_moves(self, king: Piece, in_check: bool, occupied: int, moves: array, targets: int = FULL) -> int:
+        # king moves go at the start of the buffer
+        king_square = king.y*self.board.width + king.x
+        opponent = self.board.opponent_turn
+
+        # lift the king off the board so it can't step back along a slider's ray
+        occupied_without_king = occupied ^ (1 << king_square)
+
+        count = 0
+        for index in range(get_king_moves(self.board, king, moves, 0)):
+            move = moves[index]
+            target_square = move >> TO_SHIFT & SQUARE_MASK
+            if not targets >> target_square & 1:
+                continue
 
-        for move in pseudo_legal_moves:
             # stops castling out of or through check
-            if move.move_type == MoveType.CASTLE_KING_SIDE:
-                if in_check or self.is_attacked(current_turn_king.x+1, current_turn_king.y, opponent_pieces):
+            move_type = move & TYPE_FIELD
+            if move_type == CASTLE_KING_SIDE_FLAG:
+                if in_check or self.is_square_attacked(king_square+1, opponent, occupied) or self.is_square_attacked(king_square+2, opponent, occupied):
                     continue
-            elif move.move_type == MoveType.CASTLE_QUEEN_SIDE:
-                if in_check or self.is_attacked(current_turn_king.x-1, current_turn_king.y, opponent_pieces):
+            elif move_type == CASTLE_QUEEN_SIDE_FLAG:
+                if in_check or self.is_square_attacked(king_square-1, opponent, occupied) or self.is_square_attacked(king_square-2, opponent, occupied):
                     continue
+            elif self.is_square_attacked(target_square, opponent, occupied_without_king):
+                continue
+            moves[count] = move
+            count += 1
 
-            # checks if king is attacked after making move -> illegal
-            self.perform_move(move)
-
-            if not self.is_attacked(current_turn_king.x, current_turn_king.y, opponent_pieces):
-                legal_moves.append(move)
+        return count
 
-            self.unperform_move(move)
+    def is_enpassant_legal(self, move: int, king_square: int, occupied: int) -> bool:
+        # both pawns leave their squares at once so recheck the king with the board as it will be
+        # -> covers the pawns being pinned together along a rank
+        enpassant_pawn = self.board.enpassant_target[2]
+        occupied ^= 1 << (move & SQUARE_MASK)
+        occupied ^= 1 << (enpassant_pawn.y*self.board.width + enpassant_pawn.x)
+        occupied |= 1 << (move >> TO_SHIFT & SQUARE_MASK)
+        return not self.is_square_attacked(king_square, self.board.opponent_turn, occupied)
 
-        return legal_moves
+    def get_pinned(self, king_square: int, colour: Colour, occupied: int) -> int:
+        pawns, knights, bishops, rooks, queens, king = self.board.bitboards[colour ^ 1]
+        own = self.board.occupancy[colour]
+        return (get_pinned(king_square, BISHOP_RAYS, occupied, own, bishops | queens) |
+                get_pinned(king_square, ROOK_RAYS, occupied, own, rooks | queens))
 
     def is_gameover(self, in_check: bool, number_of_valid_moves: int) -> GameStates:
-        if self.board.half_moves >= 50:
-            print("STALEMATE! 50 move rule")
-            return GameStates.STALEMATE
-
+        # mate on the move that reaches the fifty move limit still counts, so no moves is checked first
         if number_of_valid_moves == 0:
             if in_check:
                 print(f"CHECKMATE! {self.board.opponent_turn.name} WINS")
@@ -57,102 +153,483 @@ class Engine:
             else:
                 print("STALEMATE!")
                 return GameStates.STALEMATE
+
+        draw = self.get_draw()
+        if draw is not None:
+            print(f"DRAW! {draw}")
+            return GameStates.DRAW
+
         if in_check:
             print('CHECK!')
             return GameStates.CHECK
         return GameStates.NOTHING
 
-    def perform_move(self, move: Move) -> None:
+    def get_draw(self) -> str | None:
+        # name of the rule that draws the position, the game is adjudicated as soon as one applies
+        if self.board.half_moves >= FIFTY_MOVE_PLIES:
+            return "fifty move rule"
+        if self.board.count_repetitions(2) >= 2:
+            return "threefold repetition"
+        if self.board.is_insufficient_material():
+            return "insufficient material"
+        return None
+
+    def make_move(self, move: int) -> tuple:
+        piece = self.board.board[move & SQUARE_MASK]
+        if move & TYPE_FIELD == EN_PASSANT_FLAG:
+            captured = self.board.enpassant_target[2]
+        else:
+            captured = self.board.board[move >> TO_SHIFT & SQUARE_MASK]
+
+        # irreversible state is returned so the move can be taken back
+        previous_state = (self.board.enpassant_target,
+                          self.board.castling_rights[Colour.WHITE].copy(),
+                          self.board.castling_rights[Colour.BLACK].copy(),
+                          self.board.half_moves,
+                          self.board.full_moves,
+                          self.board.hash,
+                          captured)
+        self.board.hash_stack.append(self.board.hash)
+        # read before the move as a promoting pawn comes out as the piece it became
+        piece_type = piece.piece_type
+
+        self.update_castling_rights(move, piece, captured)
+        self.perform_move(move, piece, captured)
+        self.set_enpassant_target(move, piece)
+        self.perform_castle(move, piece)
+
+        self.board.update_full_moves()
+        self.board.update_half_moves(piece_type, captured)
+        self.board.switch_turn()
+
+        if self.debug:
+            self.verify_hash()
+
+        return previous_state
+
+    def unmake_move(self, move: int, previous_state: tuple) -> None:
+        enpassant_target, white_castling_rights, black_castling_rights, half_moves, full_moves, board_hash, captured = previous_state
+        piece = self.board.board[move >> TO_SHIFT & SQUARE_MASK]
+
+        self.board.switch_turn()
+        self.unperform_castle(move, piece)
+        self.unperform_move(move, piece, captured)
+
+        self.board.enpassant_target = enpassant_target
+        # the pieces are back where they were when the target was set, so its key comes out the same
+        self.board.enpassant_key = self.board.get_enpassant_key(*enpassant_target)
+        self.board.castling_rights[Colour.WHITE] = white_castling_rights
+        self.board.castling_rights[Colour.BLACK] = black_castling_rights
+        self.board.half_moves = half_moves
+        self.board.full_moves = full_moves
+        # castling and en passant keys are restored wholesale rather than xored back out
+        self.board.hash = board_hash
+        self.board.hash_stack.pop()
+
+        if self.debug:
+            self.verify_hash()
+
+    def verify_hash(self) -> None:
+        full_hash = self.board.get_hash()
+        if self.board.hash != full_hash:
+            raise AssertionError(f"Zobrist key out of sync: {self.board.hash:016x} != {full_hash:016x} for {self.board.get_FEN()}")
+
+    def perform_move(self, move: int, piece: Piece, captured: Piece) -> None:
         # perform capture
-        if move.target is not None:
-            move.target.alive = False
-            self.board.set_piece(move.target.x, move.target.y, None)
+        if captured is not None:
+            captured.alive = False
+            self.board.set_piece(captured.x, captured.y, None)
+
+        # lift piece first so the bitboards clear its type before any promotion
+        self.board.set_piece(piece.x, piece.y, None)
 
-        # perform promotion
-        if move.move_type == MoveType.PROMOTION:
-            # TODO: Add promotion to other pieces -> link to UI
-            move.piece.piece_type = PieceType.QUEEN
+        # perform promotion -> the new piece type is packed into the move
+        if move & TYPE_FIELD == PROMOTION_FLAG:
+            piece.piece_type = PieceType(move >> PROMOTION_SHIFT & 7)
 
         # move piece
-        move.piece.x = move.target_x
-        move.piece.y = move.target_y
-        self.board.set_piece(move.target_x, move.target_y, move.piece)
-        self.board.set_piece(move.piece_x, move.piece_y, None)
+        target_square = move >> TO_SHIFT & SQUARE_MASK
+        piece.x = target_square % self.board.width
+        piece.y = target_square // self.board.width
+        self.board.set_piece(piece.x, piece.y, piece)
 
-    def unperform_move(self, move: Move) -> None:
+    def unperform_move(self, move: int, piece: Piece, captured: Piece) -> None:
         # unmove piece
-        move.piece.x = move.piece_x
-        move.piece.y = move.piece_y
-        self.board.set_piece(move.target_x, move.target_y, None)
-        self.board.set_piece(move.piece_x, move.piece_y, move.piece)
+        self.board.set_piece(piece.x, piece.y, None)
 
         # unperform promotion
-        if move.move_type == MoveType.PROMOTION:
-            move.piece.piece_type = PieceType.PAWN
+        if move & TYPE_FIELD == PROMOTION_FLAG:
+            piece.piece_type = PieceType.PAWN
+
+        from_square = move & SQUARE_MASK
+        piece.x = from_square % self.board.width
+        piece.y = from_square // self.board.width
+        self.board.set_piece(piece.x, piece.y, piece)
 
         # unperform capture
-        if move.target is not None:
-            move.target.alive = True
-            self.board.set_piece(move.target.x, move.target.y, move.target)
+        if captured is not None:
+            captured.alive = True
+            self.board.set_piece(captured.x, captured.y, captured)
 
-    def is_attacked(self, x: int, y: int, opponent_pieces: list[Piece]) -> bool:
-        for opponent_piece in opponent_pieces:
-            if not opponent_piece.alive:
-                continue
-            for move in get_moves(self.board, opponent_piece):
-                if x == move.target_x and y == move.target_y:
-                    return True
-        return False
-
-    def set_enpassant_target(self, move: Move) -> None:
-        if move.move_type == MoveType.DOUBLE_PUSH:
-            direction = -1 if move.piece.colour == Colour.WHITE else 1
-            self.board.enpassant_target = (move.target_x,move.target_y-direction,move.piece)
+    def is_attacked(self, x: int, y: int, attacker: Colour) -> bool:
+        return self.is_square_attacked(y*self.board.width + x, attacker, self.board.get_occupied())
+
+    def is_square_attacked(self, square: int, attacker: Colour, occupied: int) -> bool:
+        # pieces missing from occupied are treated as captured
+        pawns, knights, bishops, rooks, queens, king = self.board.bitboards[attacker]
+
+        # look outward from the square with each piece's attack pattern for a matching attacker
+        if KNIGHT_ATTACKS[square] & knights & occupied:
+            return True
+        # squares a pawn could attack from are the squares an opposite coloured pawn here attacks
+        if PAWN_ATTACKS[attacker ^ 1][square] & pawns & occupied:
+            return True
+        if KING_ATTACKS[square] & king:
+            return True
+
+        return (is_ray_attacked(square, BISHOP_RAYS, occupied, (bishops | queens) & occupied) or
+                is_ray_attacked(square, ROOK_RAYS, occupied, (rooks | queens) & occupied))
+
+    def get_attackers(self, square: int, attacker: Colour, occupied: int) -> int:
+        pawns, knights, bishops, rooks, queens, king = self.board.bitboards[attacker]
+        return ((KNIGHT_ATTACKS[square] & knights) |
+                (PAWN_ATTACKS[attacker ^ 1][square] & pawns) |
+                (KING_ATTACKS[square] & king) |
+                (get_sliding_attacks(square, BISHOP_RAYS, occupied) & (bishops | queens)) |
+                (get_sliding_attacks(square, ROOK_RAYS, occupied) & (rooks | queens)))
+
+    def set_enpassant_target(self, move: int, piece: Piece) -> None:
+        if move & TYPE_FIELD == DOUBLE_PUSH_FLAG:
+            # target is the square the pawn skipped over, halfway between from and to
+            from_square = move & SQUARE_MASK
+            target_square = (from_square + (move >> TO_SHIFT & SQUARE_MASK)) // 2
+            self.board.set_enpassant_target(target_square % self.board.width, target_square // self.board.width, piece)
         else:
-            self.board.enpassant_target = (-1,-1,None)
+            self.board.set_enpassant_target(-1, -1, None)
 
-    def perform_castle(self, move: Move) -> None:
+    def perform_castle(self, move: int, king: Piece) -> None:
         # king has already moved two spaces so just need to jump rook
-        if move.move_type == MoveType.CASTLE_KING_SIDE:
+        move_type = move & TYPE_FIELD
+        if move_type == CASTLE_KING_SIDE_FLAG:
             direction = -1
-            if move.piece.colour == Colour.WHITE:
-                rook = self.board.get_piece(7, 7)
-            else:
-                rook = self.board.get_piece(7, 0)
-        elif move.move_type == MoveType.CASTLE_QUEEN_SIDE:
+            rook = self.board.get_piece(7, king.y)
+        elif move_type == CASTLE_QUEEN_SIDE_FLAG:
             direction = 1
-            if move.piece.colour == Colour.WHITE:
-                rook = self.board.get_piece(0, 7)
-            else:
-                rook = self.board.get_piece(0, 0)
+            rook = self.board.get_piece(0, king.y)
         else:
             # haven't castled
             return
 
         self.board.set_piece(rook.x, rook.y, None)
-        self.board.set_piece(move.piece.x+direction, move.piece.y, rook)
-        rook.x = move.piece.x+direction
-        rook.y = move.piece.y
+        self.board.set_piece(king.x+direction, king.y, rook)
+        rook.x = king.x+direction
+        rook.y = king.y
+
+    def unperform_castle(self, move: int, king: Piece) -> None:
+        # king is still on its castled square so rook sits next to it
+        move_type = move & TYPE_FIELD
+        if move_type == CASTLE_KING_SIDE_FLAG:
+            direction = -1
+            rook_x = 7
+        elif move_type == CASTLE_QUEEN_SIDE_FLAG:
+            direction = 1
+            rook_x = 0
+        else:
+            return
+
+        rook = self.board.get_piece(king.x+direction, king.y)
+        self.board.set_piece(rook.x, rook.y, None)
+        self.board.set_piece(rook_x, king.y, rook)
+        rook.x = rook_x
 
-    def update_castling_rights(self, move: Move) -> None:
+    def update_castling_rights(self, move: int, piece: Piece, captured: Piece) -> None:
+        # called before the move is performed so pieces are still on their starting squares
         # can't castle if moved king
-        if move.piece.piece_type == PieceType.KING or move.move_type == MoveType.CASTLE_KING_SIDE or move.move_type == MoveType.CASTLE_QUEEN_SIDE:
-            self.board.castling_rights[move.piece.colour] = [False, False]
-
-        # captured opponent's rook
-        if move.target is not None and move.target.piece_type == PieceType.ROOK:
-            # kingside rook captured
-            if move.target_x == 7 and move.target_y == 7 or move.target_x == 7 and move.target_y == 0:
-                self.board.castling_rights[move.target.colour][0] = False
-            # queenside rook captured
-            if move.target_x == 0 and move.target_y == 7 or move.target_x == 0 and move.target_y == 0:
-                self.board.castling_rights[move.target.colour][1] = False
-
-        # moved your rook
-        if move.piece.piece_type == PieceType.ROOK:
-            # kingside rook moved
-            if move.piece_x == 7 and move.piece_y == 7 or move.piece_x == 7 and move.piece_y == 0:
-                self.board.castling_rights[move.piece.colour][0] = False
-            # queenside rook moved
-            if move.piece_x == 0 and move.piece_y == 7 or move.piece_x == 0 and move.piece_y == 0:
-                self.board.castling_rights[move.piece.colour][1] = False
+        if piece.piece_type == PieceType.KING:
+            self.board.remove_castling_right(piece.colour, 0)
+            self.board.remove_castling_right(piece.colour, 1)
+
+        # captured opponent's rook on its starting square -> compared against that colour's squares, a rook on the other back rank has no right to lose
+        if captured is not None and captured.piece_type == PieceType.ROOK:
+            kingside_square, queenside_square = CASTLING_SQUARES[captured.colour][1]
+            square = captured.y*self.board.width + captured.x
+            if square == kingside_square:
+                self.board.remove_castling_right(captured.colour, 0)
+            if square == queenside_square:
+                self.board.remove_castling_right(captured.colour, 1)
+
+        # moved your rook off its starting square
+        if piece.piece_type == PieceType.ROOK:
+            kingside_square, queenside_square = CASTLING_SQUARES[piece.colour][1]
+            square = piece.y*self.board.width + piece.x
+            if square == kingside_square:
+                self.board.remove_castling_right(piece.colour, 0)
+            if square == queenside_square:
+                self.board.remove_castling_right(piece.colour, 1)
+
+    def perft(self, depth: int, table: TranspositionTable = None) -> int:
+        if depth == 0:
+            return 1
+
+        # transposed subtree -> reuse its count, which is only valid at the same depth
+        if table is not None and depth > 1:
+            entry = table.probe(self.board.hash)
+            if entry is not None and entry[0] == depth:
+                return entry[1]
+
+        # each remaining depth has its own buffer so children don't overwrite the moves still being looped over
+        moves = self.move_buffers[depth]
+        in_check, count = self.generate_moves(moves)
+        # bulk count leaf nodes instead of making every last move
+        if depth == 1:
+            return count
+
+        nodes = 0
+        for index in range(count):
+            move = moves[index]
+            previous_state = self.make_move(move)
+            nodes += self.perft(depth-1, table)
+            self.unmake_move(move, previous_state)
+
+        if table is not None:
+            table.store(self.board.hash, depth, nodes, Bound.EXACT)
+        return nodes
+
+    def search(self, depth: int = None, time_limit: float = None, report: Callable[[SearchResult], None] = None,
+               alpha: int = -MATE_SCORE, beta: int = MATE_SCORE) -> SearchResult:
+        # a narrower window than a full one only proves scores inside it, anything at or past beta is a bound
+        if depth is None and time_limit is None:
+            raise ValueError("Search needs a depth, a time limit or both")
+        if self.table is None:
+            self.table = TranspositionTable()
+
+        max_depth = MAX_PLY if depth is None else min(depth, MAX_PLY)
+        start_time = perf_counter()
+        self.deadline = None if time_limit is None else start_time + time_limit
+        self.stopped = False
+        self.nodes = 0
+        self.table.new_search()
+        self.ordering.new_search()
+
+        in_check, legal_moves = self.generate_legal_moves()
+        if not legal_moves:
+            return SearchResult(None, -MATE_SCORE if in_check else 0, 0)
+        result = SearchResult(legal_moves[0], 0, 0)
+        # without pawns nothing can be promoted, so a root short of mating material stays drawn in every line below it
+        self.insufficient_material = self.board.is_insufficient_material()
+
+        # iterative deepening -> each finished depth leaves its best moves in the table to guide the next
+        for current_depth in range(1, max_depth+1):
+            score = self.negamax(current_depth, 0, alpha, beta)
+            # a cut off iteration can't be trusted, keep the last finished one
+            if self.stopped:
+                break
+
+            principal_variation = self.principal_variations[0]
+            result = SearchResult(principal_variation[0], score, current_depth, principal_variation, self.nodes, perf_counter() - start_time,
+                                  self.ordering.get_first_move_cutoff_rate())
+            if report is not None:
+                report(result)
+
+            # found a forced mate, searching deeper won't change it
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break
+
+        result.nodes = self.nodes
+        result.time = perf_counter() - start_time
+        return result
+
+    def negamax(self, depth: int, ply: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        self.principal_variations[ply] = []
+
+        if self.deadline is not None and self.nodes & 1023 == 0 and perf_counter() > self.deadline:
+            self.stopped = True
+        if self.stopped:
+            return 0
+
+        # drawn positions below the root -> a repetition is scored as a draw the first time it comes back, as either side could repeat it again
+        # below a root with enough material it only runs out on a capture, which resets half moves, and nothing repeats within four plies
+        if ply > 0:
+            half_moves = self.board.half_moves
+            if (half_moves >= FIFTY_MOVE_PLIES or half_moves >= 4 and self.board.is_repetition() or self.insufficient_material or
+                half_moves == 0 and self.board.is_insufficient_material()):
+                return 0
+
+        if depth == 0 or ply >= MAX_PLY:
+            return self.quiescence(ply, alpha, beta)
+
+        # transposition -> reuse a result from at least this depth if its bound settles the window
+        original_alpha = alpha
+        key = self.board.hash
+        entry = self.table.probe(key)
+        hash_move = 0
+        if entry is not None:
+            entry_depth, entry_score, bound, hash_move = entry
+            if ply > 0 and entry_depth >= depth:
+                entry_score = self.score_from_table(entry_score, ply)
+                if (bound == Bound.EXACT or
+                    bound == Bound.LOWER and entry_score >= beta or
+                    bound == Bound.UPPER and entry_score <= alpha):
+                    return entry_score
+
+        moves = self.move_buffers[ply]
+        in_check, count = self.generate_moves(moves)
+        if not count:
+            # prefer quicker mates and slower losses
+            return -MATE_SCORE + ply if in_check else 0
+
+        best_score = -MATE_SCORE
+        best_move = 0
+        for move_index, move in enumerate(self.ordering.order_moves(self.board, moves, count, ply, hash_move)):
+            previous_state = self.make_move(move)
+            score = -self.negamax(depth-1, ply+1, -beta, -alpha)
+            self.unmake_move(move, previous_state)
+
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.principal_variations[ply] = [move] + self.principal_variations[ply+1]
+                    if alpha >= beta:
+                        self.ordering.update_cutoff(self.board, move, ply, depth, move_index)
+                        break
+
+        if best_score >= beta:
+            bound = Bound.LOWER
+        elif best_score > original_alpha:
+            bound = Bound.EXACT
+        else:
+            bound = Bound.UPPER
+        self.table.store(key, depth, self.score_to_table(best_score, ply), bound, best_move)
+
+        return best_score
+
+    def score_to_table(self, score: int, ply: int) -> int:
+        # mate scores are stored as distance from this node rather than from the root
+        if score >= MATE_SCORE - MAX_PLY:
+            return score + ply
+        if score <= -MATE_SCORE + MAX_PLY:
+            return score - ply
+        return score
+
+    def score_from_table(self, score: int, ply: int) -> int:
+        if score >= MATE_SCORE - MAX_PLY:
+            return score - ply
+        if score <= -MATE_SCORE + MAX_PLY:
+            return score + ply
+        return score
+
+    def quiescence(self, ply: int, alpha: int, beta: int) -> int:
+        # only captures and promotions are searched so the evaluation is taken from a quiet position
+        self.nodes += 1
+        self.principal_variations[ply] = []
+
+        if self.deadline is not None and self.nodes & 1023 == 0 and perf_counter() > self.deadline:
+            self.stopped = True
+        if self.stopped:
+            return 0
+
+        if ply >= MAX_PLY:
+            return evaluate(self.board)
+
+        king = self.board.pieces[self.board.current_turn][0]
+        in_check = self.is_attacked(king.x, king.y, self.board.opponent_turn)
+        moves = self.move_buffers[ply]
+
+        # stand pat -> the side to move can usually do at least as well as the static evaluation by not capturing
+        best_score = -MATE_SCORE
+        if not in_check:
+            best_score = evaluate(self.board)
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+
+            promotion_rank = get_rank(0) if self.board.current_turn == Colour.WHITE else get_rank(self.board.height-1)
+            in_check, count = self.generate_moves(moves, self.board.occupancy[self.board.opponent_turn] | promotion_rank)
+            # the promotion rank lets every piece through, keep only pawns promoting there (to a queen, underpromoting
+            # is never better for winning material) and skip captures that lose material once every recapture is played out
+            searched = 0
+            for index in range(count):
+                move = moves[index]
+                if not is_quiet(move) and not is_underpromotion(move) and self.static_exchange(move) >= 0:
+                    moves[searched] = move
+                    searched += 1
+            count = searched
+        else:
+            # in check -> every evasion has to be looked at
+            in_check, count = self.generate_moves(moves)
+            if not count:
+                return -MATE_SCORE + ply
+
+        for move in self.ordering.order_moves(self.board, moves, count, ply):
+            previous_state = self.make_move(move)
+            score = -self.quiescence(ply+1, -beta, -alpha)
+            self.unmake_move(move, previous_state)
+
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    self.principal_variations[ply] = [move] + self.principal_variations[ply+1]
+                    if alpha >= beta:
+                        break
+
+        return best_score
+
+    def static_exchange(self, move: int) -> int:
+        # material won or lost on the target square if both sides keep recapturing with their least valuable piece
+        from_square = move & SQUARE_MASK
+        target_square = move >> TO_SHIFT & SQUARE_MASK
+        piece = self.board.board[from_square]
+        target = self.board.board[target_square]
+        occupied = self.board.get_occupied() ^ (1 << from_square)
+
+        gains = [0 if target is None else PIECE_VALUES[target.piece_type]]
+        move_type = move & TYPE_FIELD
+        if move_type == EN_PASSANT_FLAG:
+            enpassant_pawn = self.board.enpassant_target[2]
+            occupied ^= 1 << (enpassant_pawn.y*self.board.width + enpassant_pawn.x)
+            gains[0] = PIECE_VALUES[PieceType.PAWN]
+        if move_type == PROMOTION_FLAG:
+            promotion = PieceType(move >> PROMOTION_SHIFT & 7)
+            gains[0] += PIECE_VALUES[promotion] - PIECE_VALUES[PieceType.PAWN]
+            attacker_value = PIECE_VALUES[promotion]
+        else:
+            attacker_value = PIECE_VALUES[piece.piece_type]
+
+        side = piece.colour ^ 1
+        while True:
+            # speculative -> what the last capture nets if it gets recaptured
+            gains.append(attacker_value - gains[-1])
+
+            # removed pieces drop out of occupied, which also uncovers sliders lined up behind them
+            attackers = self.get_attackers(target_square, side, occupied) & occupied
+            if not attackers:
+                break
+
+            for piece_type, pieces in enumerate(self.board.bitboards[side]):
+                least_valuable = attackers & pieces
+                if least_valuable:
+                    break
+
+            attacker_value = PIECE_VALUES[piece_type]
+            occupied ^= least_valuable & -least_valuable
+            side ^= 1
+
+        # last entry assumed a recapture that never happens
+        gains.pop()
+
+        # either side can stop recapturing when it would lose out
+        while len(gains) > 1:
+            score = gains.pop()
+            gains[-1] = -max(-gains[-1], score)
+
+        return gains[0]
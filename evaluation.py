@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from constants import Colour, PieceType, PIECE_VALUES
+from bitboards import get_squares
+
+if TYPE_CHECKING:
+    from board import Board
+
+# Piece square tables from white's side, laid out in square order (a8 first) -> black reads them mirrored
+# https://www.chessprogramming.org/Simplified_Evaluation_Function
+PIECE_SQUARE_TABLES = {
+    PieceType.PAWN: (
+          0,  0,  0,  0,  0,  0,  0,  0,
+         50, 50, 50, 50, 50, 50, 50, 50,
+         10, 10, 20, 30, 30, 20, 10, 10,
+          5,  5, 10, 25, 25, 10,  5,  5,
+          0,  0,  0, 20, 20,  0,  0,  0,
+          5, -5,-10,  0,  0,-10, -5,  5,
+          5, 10, 10,-20,-20, 10, 10,  5,
+          0,  0,  0,  0,  0,  0,  0,  0),
+    PieceType.KNIGHT: (
+        -50,-40,-30,-30,-30,-30,-40,-50,
+        -40,-20,  0,  0,  0,  0,-20,-40,
+        -30,  0, 10, 15, 15, 10,  0,-30,
+        -30,  5, 15, 20, 20, 15,  5,-30,
+        -30,  0, 15, 20, 20, 15,  0,-30,
+        -30,  5, 10, 15, 15, 10,  5,-30,
+        -40,-20,  0,  5,  5,  0,-20,-40,
+        -50,-40,-30,-30,-30,-30,-40,-50),
+    PieceType.BISHOP: (
+        -20,-10,-10,-10,-10,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5, 10, 10,  5,  0,-10,
+        -10,  5,  5, 10, 10,  5,  5,-10,
+        -10,  0, 10, 10, 10, 10,  0,-10,
+        -10, 10, 10, 10, 10, 10, 10,-10,
+        -10,  5,  0,  0,  0,  0,  5,-10,
+        -20,-10,-10,-10,-10,-10,-10,-20),
+    PieceType.ROOK: (
+          0,  0,  0,  0,  0,  0,  0,  0,
+          5, 10, 10, 10, 10, 10, 10,  5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+          0,  0,  0,  5,  5,  0,  0,  0),
+    PieceType.QUEEN: (
+        -20,-10,-10, -5, -5,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5,  5,  5,  5,  0,-10,
+         -5,  0,  5,  5,  5,  5,  0, -5,
+          0,  0,  5,  5,  5,  5,  0, -5,
+        -10,  5,  5,  5,  5,  5,  0,-10,
+        -10,  0,  5,  0,  0,  0,  0,-10,
+        -20,-10,-10, -5, -5,-10,-10,-20),
+    PieceType.KING: (
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -20,-30,-30,-40,-40,-30,-30,-20,
+        -10,-20,-20,-20,-20,-20,-20,-10,
+         20, 20,  0,  0,  0,  0, 20, 20,
+         20, 30, 10,  0,  0, 10, 30, 20),
+}
+
+# material and position combined -> PIECE_SCORES[colour][piece_type][square], flipping the rank (square ^ 56) for black
+PIECE_SCORES = [[[PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][square if colour == Colour.WHITE else square ^ 56]
+                  for square in range(64)] for piece_type in PieceType] for colour in Colour]
+
+
+def evaluate(board: Board) -> int:
+    # score in centipawns from the point of view of the player to move
+    score = 0
+    for white_pieces, black_pieces, white_scores, black_scores in zip(board.bitboards[Colour.WHITE], board.bitboards[Colour.BLACK],
+                                                                      PIECE_SCORES[Colour.WHITE], PIECE_SCORES[Colour.BLACK]):
+        for square in get_squares(white_pieces):
+            score += white_scores[square]
+        for square in get_squares(black_pieces):
+            score -= black_scores[square]
+
+    return score if board.current_turn == Colour.WHITE else -score
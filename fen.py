@@ -0,0 +1,175 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+import re
+
+from constants import Colour, PieceType, BOARD_WIDTH, BOARD_HEIGHT, PIECE_TO_STRING, RANKS, FILES
+
+if TYPE_CHECKING:
+    from board import Board
+
+# piece letter -> (colour, piece type), white pieces are upper case
+CHAR_TO_PIECE = {}
+for piece_type, char in PIECE_TO_STRING.items():
+    CHAR_TO_PIECE[char.upper()] = (Colour.WHITE, piece_type)
+    CHAR_TO_PIECE[char] = (Colour.BLACK, piece_type)
+# PIECE_TO_CHAR[colour][piece_type]
+PIECE_TO_CHAR = [[PIECE_TO_STRING[piece_type].upper() for piece_type in PieceType], [PIECE_TO_STRING[piece_type] for piece_type in PieceType]]
+EMPTY_TO_CHAR = [str(count) for count in range(BOARD_WIDTH+1)]
+# placements are checked a rank at a time once every run of empty squares is expanded to dots, e.g. 3p4 -> ...p....
+EXPAND_EMPTY = str.maketrans({EMPTY_TO_CHAR[count]: '.'*count for count in range(1, BOARD_WIDTH+1)})
+# anything but pieces, counts and slashes, or two counts in a row which no FEN writer produces
+INVALID_PLACEMENT = re.compile(f"[^{''.join(CHAR_TO_PIECE)}1-{BOARD_WIDTH}/]|[1-{BOARD_WIDTH}]{{2}}")
+COLOURS = tuple(Colour)
+
+# every valid castling field -> ((white kingside, white queenside), (black kingside, black queenside)), so order and repeats are checked in one lookup
+CASTLING_FIELDS = {}
+for rights in range(16):
+    field = ''.join(char for bit, char in enumerate("KQkq") if rights >> bit & 1) or '-'
+    CASTLING_FIELDS[field] = ((bool(rights & 1), bool(rights & 2)), (bool(rights & 4), bool(rights & 8)))
+CASTLING_TO_FIELD = {rights: field for field, rights in CASTLING_FIELDS.items()}
+# king square and (kingside, queenside) rook squares each right needs -> y = 0 is black's back rank
+CASTLING_SQUARES = {
+    Colour.WHITE: ((BOARD_HEIGHT-1)*BOARD_WIDTH + 4, ((BOARD_HEIGHT-1)*BOARD_WIDTH + BOARD_WIDTH-1, (BOARD_HEIGHT-1)*BOARD_WIDTH)),
+    Colour.BLACK: (4, (BOARD_WIDTH-1, 0))
+}
+
+# en passant targets by the side to move -> white captures onto the sixth rank, black onto the third
+EN_PASSANT_FIELDS = {
+    Colour.WHITE: {f"{RANKS[x]}{FILES[2]}": (x, 2) for x in range(BOARD_WIDTH)},
+    Colour.BLACK: {f"{RANKS[x]}{FILES[BOARD_HEIGHT-3]}": (x, BOARD_HEIGHT-3) for x in range(BOARD_WIDTH)}
+}
+TURN_FIELDS = {'w': Colour.WHITE, 'b': Colour.BLACK}
+
+
+class PositionError(ValueError):
+    def __init__(self, field: str, reason: str) -> None:
+        '''Raised for a position that breaks the rules whatever it was read from, field names the part that's wrong'''
+        super().__init__(f"Invalid position {field}, {reason}")
+        self.field = field
+        self.reason = reason
+
+class FENError(ValueError):
+    def __init__(self, fen_string: str, field: str, reason: str) -> None:
+        '''Raised for a FEN string that doesn't describe a valid position, field names the part that's wrong'''
+        super().__init__(f"Invalid FEN {field}, {reason}: {fen_string}")
+        self.fen_string = fen_string
+        self.field = field
+        self.reason = reason
+
+@dataclass (slots=True)
+class FENPosition:
+    # checked contents of a FEN string, nothing is put on a board until all of it is valid
+    pieces: list[tuple[int, Colour, PieceType]]
+    turn: Colour
+    castling_rights: tuple[tuple[bool, bool], tuple[bool, bool]]
+    enpassant_target: tuple[int, int] | None
+    half_moves: int
+    full_moves: int
+
+
+def parse_FEN(fen_string: str) -> FENPosition:
+    fields = fen_string.split()
+    if len(fields) != 6:
+        raise FENError(fen_string, "string", f"expected 6 fields, got {len(fields)}")
+    placement, turn, castling, en_passant, half_moves, full_moves = fields
+
+    squares = parse_placement(fen_string, placement)
+
+    if turn not in TURN_FIELDS:
+        raise FENError(fen_string, "turn", f"expected w or b, got {turn!r}")
+    turn = TURN_FIELDS[turn]
+
+    castling_rights = CASTLING_FIELDS.get(castling)
+    if castling_rights is None:
+        raise FENError(fen_string, "castling", f"expected - or some of KQkq in that order, got {castling!r}")
+
+    enpassant_target = None
+    if en_passant != '-':
+        enpassant_target = EN_PASSANT_FIELDS[turn].get(en_passant)
+        if enpassant_target is None:
+            raise FENError(fen_string, "en passant", f"{en_passant!r} isn't a square the side to move can capture onto")
+
+    try:
+        validate_position(squares, turn, castling_rights, enpassant_target)
+    except PositionError as error:
+        raise FENError(fen_string, error.field, error.reason) from None
+
+    return FENPosition(get_pieces(squares), turn, castling_rights, enpassant_target,
+                       parse_counter(fen_string, "half moves", half_moves), parse_counter(fen_string, "full moves", full_moves))
+
+def parse_placement(fen_string: str, placement: str) -> str:
+    # the placement as one character per square, a piece letter or '.' -> only the syntax is checked here, see validate_position
+    invalid = INVALID_PLACEMENT.search(placement)
+    if invalid is not None:
+        raise FENError(fen_string, "placement", f"unexpected {invalid.group()!r}")
+
+    rows = placement.translate(EXPAND_EMPTY).split('/')
+    if len(rows) != BOARD_HEIGHT:
+        raise FENError(fen_string, "placement", f"expected {BOARD_HEIGHT} ranks, got {len(rows)}")
+    for y, row in enumerate(rows):
+        if len(row) != BOARD_WIDTH:
+            raise FENError(fen_string, "placement", f"rank {FILES[y]} covers {len(row)} squares, not {BOARD_WIDTH}")
+    return ''.join(rows)
+
+def validate_position(squares: str, turn: Colour, castling_rights: tuple[tuple[bool, bool], tuple[bool, bool]], enpassant_target: tuple[int, int] | None) -> None:
+    # the rules a position has to follow however it was stored, squares as from parse_placement -> raises PositionError for the first one broken
+    back_ranks = squares[:BOARD_WIDTH] + squares[-BOARD_WIDTH:]
+    if 'p' in back_ranks or 'P' in back_ranks:
+        raise PositionError("placement", "pawn on a back rank")
+
+    for colour in COLOURS:
+        king_count = squares.count(PIECE_TO_CHAR[colour][PieceType.KING])
+        if king_count != 1:
+            raise PositionError("placement", f"expected one {colour.name.lower()} king, got {king_count}")
+
+    for colour in COLOURS:
+        king_square, rook_squares = CASTLING_SQUARES[colour]
+        for side in range(2):
+            if castling_rights[colour][side] and (squares[king_square] != PIECE_TO_CHAR[colour][PieceType.KING] or squares[rook_squares[side]] != PIECE_TO_CHAR[colour][PieceType.ROOK]):
+                raise PositionError("castling", f"{'KQkq'[colour*2 + side]} without the king and rook on their starting squares")
+
+    if enpassant_target is not None:
+        # the pawn that just moved two squares sits in front of the target with the squares it passed over empty
+        x, y = enpassant_target
+        direction = 1 if turn == Colour.WHITE else -1
+        if (squares[(y+direction)*BOARD_WIDTH + x] != PIECE_TO_CHAR[turn ^ 1][PieceType.PAWN]
+                or squares[y*BOARD_WIDTH + x] != '.' or squares[(y-direction)*BOARD_WIDTH + x] != '.'):
+            raise PositionError("en passant", f"no pawn could have just moved past {RANKS[x]}{FILES[y]}")
+
+def get_pieces(squares: str) -> list[tuple[int, Colour, PieceType]]:
+    # pieces in the order the board lists them, kings first -> squares has to hold one king a side
+    pieces = [(squares.index('K'), Colour.WHITE, PieceType.KING), (squares.index('k'), Colour.BLACK, PieceType.KING)]
+    for square, char in enumerate(squares):
+        if char != '.' and char != 'K' and char != 'k':
+            pieces.append((square, *CHAR_TO_PIECE[char]))
+    return pieces
+
+def parse_counter(fen_string: str, field: str, text: str) -> int:
+    # only plain canonical numbers so the string comes back out exactly as it went in
+    if not (text.isascii() and text.isdigit()) or str(int(text)) != text:
+        raise FENError(fen_string, field, f"expected a number, got {text!r}")
+    return int(text)
+
+def format_FEN(board: Board) -> str:
+    rows = []
+    for y in range(board.height):
+        row = []
+        empty_count = 0
+        for piece in board.board[y*board.width:(y+1)*board.width]:
+            if piece is None:
+                empty_count += 1
+            else:
+                if empty_count:
+                    row.append(EMPTY_TO_CHAR[empty_count])
+                    empty_count = 0
+                row.append(PIECE_TO_CHAR[piece.colour][piece.piece_type])
+        if empty_count:
+            row.append(EMPTY_TO_CHAR[empty_count])
+        rows.append(''.join(row))
+
+    castling = CASTLING_TO_FIELD[tuple(map(tuple, (board.castling_rights[Colour.WHITE], board.castling_rights[Colour.BLACK])))]
+    enpassant_x, enpassant_y, enpassant_pawn = board.enpassant_target
+    en_passant = '-' if enpassant_pawn is None else f"{RANKS[enpassant_x]}{FILES[enpassant_y]}"
+
+    return f"{'/'.join(rows)} {'w' if board.current_turn == Colour.WHITE else 'b'} {castling} {en_passant} {board.half_moves} {board.full_moves}"
@@ -1,12 +1,19 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
-import random
+from threading import Thread
 import pygame
 
-from constants import SQUARE_SIZE, BOARD_WIDTH, BOARD_HEIGHT, RANKS, FILES, FONT_SIZE, FONT_COLOUR, TEXT_OFFSET, FPS, LOAD_FILE, Colour, GameStates, PieceType
-from setup import window, clock, FONT, PIECE_SPRITES, SQUARE_SPRITES, SYMBOL_SPRITES
+from constants import BOARD_WIDTH, BOARD_HEIGHT, RANKS, FILES, START_FEN, LOAD_FILE, SEARCH_TIME_LIMIT, MOVE_CACHE_SIZE, Colour, GameStates, PieceType, MoveType
+from setup import (SQUARE_SIZE, FONT_SIZE, FONT_COLOUR, TEXT_OFFSET, FPS, IDLE, window, clock, TEXT, PIECE_SPRITES, SQUARE_SPRITES, SYMBOL_SPRITES,
+                   ENGINE_MOVE_EVENT, save_sprite_caches)
 from engine import Engine
 from board import Board
+from transposition import TranspositionTable
+from history import GameHistory, load_history
+from pgn import PGNGame, read_games, load_game_history, get_PGN
+from records import GAMES_EXTENSION, load_game_record, save_game_record
+from pieces import decode_move
+from tools.lrucache import LRUCache
 
 if TYPE_CHECKING:
     from pieces import Move
@@ -15,49 +22,61 @@ if TYPE_CHECKING:
 class Game:
     def __init__(self) -> None:
         self.board = Board()
-        self.engine = Engine(self.board)
+        self.engine = Engine(self.board, table=TranspositionTable())
+        # engine searches on its own thread, with its own copy of the board, and posts its move back as an event
+        self.thinking = False
 
         # Game variables
         self.gameover = False
 
         self.current_turn_pieces = []
-        self.opponent_pieces = []
         self.in_check = False
-        self.legal_moves = False
+        # decoded views of the engine's packed moves for selection and rendering
+        self.legal_moves = []
+        # (zobrist key, half moves) -> (in check, legal moves, game state) of positions already visited
+        self.move_cache = LRUCache(MOVE_CACHE_SIZE)
 
         # Move history
-        self.board_history = self.load_game(LOAD_FILE)
+        self.history = self.load_game(LOAD_FILE)
         self.position_index = 0
+        # ply the board is currently at and the undo states of the moves made on it since it was last rebuilt
+        self.board_ply = 0
+        self.undo_states = []
 
         # Move selection variables
         self.selected_square = None
         self.last_move = None
+        # promotions waiting on a piece to be picked, drawn as a column of squares from the promotion square
+        self.promotion_moves = []
+
+        # Rendering -> what each square showed when last drawn, only changed squares are drawn again
+        self.background = self.render_background()
+        self.drawn_square_states = [None for square in range(BOARD_WIDTH*BOARD_HEIGHT)]
 
         # Setup game
-        self.board.load_FEN(self.board_history[self.position_index])
+        self.board.load_FEN(self.history.get_snapshot(self.position_index)[1])
         self.start_new_turn()
 
     def run(self) -> None:
         self.render_board()
         while True:
             # Input
-            mouse_position = pygame.mouse.get_pos()
-            position = screen_to_square(mouse_position)
-
-            for event in pygame.event.get():
+            # sleep until something happens -> idle boards wait for input, others wake at least once a frame
+            first_event = pygame.event.wait() if IDLE else pygame.event.wait(1000 // FPS)
+            for event in [first_event] + pygame.event.get():
                 if event.type == pygame.QUIT:
                     terminate()
+                elif event.type == pygame.WINDOWEXPOSED:
+                    self.redraw()
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         terminate()
                     if event.key == pygame.K_SPACE:
-                        # perform random legal move
-                        if not self.gameover:
-                            self.deselect()
-                            self.perform_turn(random.choice(self.legal_moves))
-                            self.render_board()
+                        # perform engine's best move once it's found
+                        if not self.gameover and not self.thinking:
+                            self.start_search()
                     if event.key == pygame.K_RIGHT:
-                        self.position_index = min(len(self.board_history)-1, self.position_index+1)
+                        self.position_index = min(len(self.history)-1, self.position_index+1)
                         self.shift_position()
                     if event.key == pygame.K_LEFT:
                         self.position_index = max(0, self.position_index-1)
@@ -66,14 +85,30 @@ class Game:
                         self.position_index = 0
                         self.shift_position()
                     if event.key == pygame.K_UP:
-                        self.position_index = len(self.board_history)-1
+                        self.position_index = len(self.history)-1
                         self.shift_position()
                     if event.key == pygame.K_s:
-                        self.save_game(LOAD_FILE)
-                        print(f"Saved as file to load! {LOAD_FILE}")
+                        if self.save_game(LOAD_FILE):
+                            print(f"Saved as file to load! {LOAD_FILE}")
+
+                elif event.type == ENGINE_MOVE_EVENT:
+                    self.thinking = False
+                    # the position may have been changed while the engine was thinking
+                    if not self.gameover and event.key == self.board.hash and event.move is not None:
+                        self.deselect()
+                        self.promotion_moves = []
+                        self.perform_turn(decode_move(event.move))
+                        self.render_board()
 
                 elif event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.selected_square == None:
+                    position = screen_to_square(event.pos)
+                    if self.promotion_moves:
+                        # clicking off the picker cancels the promotion
+                        selected_move = self.get_promotion_choice(position)
+                        self.promotion_moves = []
+                        if selected_move is not None:
+                            self.perform_turn(selected_move)
+                    elif self.selected_square == None:
                         self.select(position)
                     elif position == self.selected_square:
                         self.deselect()
@@ -83,30 +118,62 @@ class Game:
                     self.render_board()
 
                 elif event.type == pygame.MOUSEBUTTONUP:
+                    position = screen_to_square(event.pos)
                     if self.selected_square is not None:
                         selected_move = self.get_selected_move(self.selected_square, position)
                         if position != self.selected_square and selected_move is not None:
                             self.deselect()
-                            self.perform_turn(selected_move)
+                            if selected_move.move_type == MoveType.PROMOTION:
+                                self.promotion_moves = self.get_promotion_moves(selected_move)
+                            else:
+                                self.perform_turn(selected_move)
                     self.render_board()
 
-            # Process
-            pygame.display.set_caption(f"FPS: {int(clock.get_fps())}/{FPS}")
-
             # Render
-            # only renders when input is made :))
-
-            pygame.display.flip()
+            # idle boards only render in response to events, and then only the squares that changed :))
+            if not IDLE:
+                self.render_board()
             clock.tick(FPS)
 
+    def start_search(self) -> None:
+        # the search makes and unmakes moves on its board, so it gets a copy rather than the one being drawn
+        board = Board()
+        board.load_FEN(self.board.get_FEN())
+        # the search can only steer into or away from repetitions of the game it knows about
+        board.hash_stack = self.board.hash_stack.copy()
+        engine = Engine(board, table=self.engine.table)
+
+        self.thinking = True
+        Thread(target=search_in_background, args=(engine, self.board.hash), daemon=True).start()
+
     def shift_position(self) -> None:
-        self.board.load_FEN(self.board_history[self.position_index])
+        self.go_to_ply(self.position_index)
         self.gameover = False
         self.selected_square = None
+        self.promotion_moves = []
         self.last_move = None
         self.start_new_turn()
         self.render_board()
 
+    def go_to_ply(self, ply: int) -> None:
+        # step back by unmaking while those moves were made on this board
+        while self.board_ply > ply and self.undo_states:
+            self.board_ply -= 1
+            self.engine.unmake_move(self.history.moves[self.board_ply], self.undo_states.pop())
+
+        # rebuild from the nearest snapshot if it's before the board or closer than replaying from the board
+        snapshot_ply, snapshot = self.history.get_snapshot(ply)
+        if self.board_ply > ply or snapshot_ply > self.board_ply:
+            self.board.load_FEN(snapshot)
+            # positions before the snapshot are still needed to spot repetitions
+            self.board.hash_stack = self.history.get_hashes(snapshot_ply, self.board.half_moves)
+            self.board_ply = snapshot_ply
+            self.undo_states = []
+
+        while self.board_ply < ply:
+            self.undo_states.append(self.engine.make_move(self.history.moves[self.board_ply]))
+            self.board_ply += 1
+
     def get_selected_move(self, piece_position: tuple[int], target_position: tuple[int]) -> Move:
         for move in self.legal_moves:
             if (move.piece_x == piece_position[0] and move.piece_y == piece_position[1] and
@@ -114,6 +181,24 @@ class Game:
                 return move
         return None
 
+    def get_promotion_moves(self, selected_move: Move) -> list[Move]:
+        # every promotion between the same squares, one per piece it can become
+        return [move for move in self.legal_moves if
+                move.piece_x == selected_move.piece_x and move.piece_y == selected_move.piece_y and
+                move.target_x == selected_move.target_x and move.target_y == selected_move.target_y]
+
+    def get_promotion_squares(self) -> list[tuple[int]]:
+        # picker runs from the promotion square back towards the middle of the board
+        move = self.promotion_moves[0]
+        direction = 1 if move.target_y == 0 else -1
+        return [(move.target_x, move.target_y + i*direction) for i in range(len(self.promotion_moves))]
+
+    def get_promotion_choice(self, position: tuple[int]) -> Move:
+        for square, move in zip(self.get_promotion_squares(), self.promotion_moves):
+            if square == position:
+                return move
+        return None
+
     def select(self, position: tuple[int]) -> None:
         self.selected_square = position
 
@@ -122,15 +207,19 @@ class Game:
 
     def start_new_turn(self) -> None:
         self.current_turn_pieces = self.board.pieces[self.board.current_turn]
-        self.opponent_pieces = self.board.pieces[self.board.opponent_turn]
 
-        self.in_check = self.engine.is_attacked(self.current_turn_pieces[0].x, self.current_turn_pieces[0].y, self.opponent_pieces)
-
-        pseudo_legal_moves = self.engine.get_pseudo_legal_moves(self.current_turn_pieces)
-        self.legal_moves = self.engine.get_legal_moves(self.in_check, pseudo_legal_moves, self.current_turn_pieces[0], self.opponent_pieces)
-
-        game_state = self.engine.is_gameover(self.in_check, len(self.legal_moves))
-        if game_state == GameStates.STALEMATE or game_state == GameStates.CHECKMATE:
+        # revisited positions reuse their moves instead of generating them again
+        # half moves and repetitions are part of the key as the game state depends on them through the draw rules
+        key = (self.board.hash, self.board.half_moves, self.board.count_repetitions())
+        turn = self.move_cache.get(key)
+        if turn is None:
+            in_check, legal_moves = self.engine.generate_legal_moves()
+            game_state = self.engine.is_gameover(in_check, len(legal_moves))
+            turn = (in_check, [decode_move(move) for move in legal_moves], game_state)
+            self.move_cache.put(key, turn)
+
+        self.in_check, self.legal_moves, game_state = turn
+        if game_state == GameStates.STALEMATE or game_state == GameStates.CHECKMATE or game_state == GameStates.DRAW:
             self.gameover = True
             self.legal_moves = []
 
@@ -138,77 +227,147 @@ class Game:
         if self.gameover:
             return
 
-        self.last_move = selected_move
-        self.engine.perform_move(selected_move)
-
-        # *Irreversible* changes
-        self.engine.set_enpassant_target(selected_move)
-        self.engine.update_castling_rights(selected_move)
-        self.engine.perform_castle(selected_move)
-
-        self.board.update_full_moves()
-        self.board.update_half_moves(selected_move)
-        self.board.switch_turn()
-
         # backtracked and made different move
-        if self.position_index != len(self.board_history)-1:
-            self.board_history = self.board_history[:self.position_index+1]
+        if self.position_index != len(self.history)-1:
+            self.history.truncate(self.position_index)
+
+        self.last_move = selected_move
+        self.undo_states.append(self.engine.make_move(selected_move.move))
+        self.board_ply += 1
 
         self.position_index += 1
-        self.board_history.append(self.board.get_FEN())
+        self.history.append(selected_move.move, self.board)
 
         self.start_new_turn()
 
-    def save_game(self, file_path: str) -> None:
+    def save_game(self, file_path: str) -> bool:
+        # .pgn files get the moves as PGN, .games files the binary records, anything else stays one FEN per line, rebuilt from the moves
+        if file_path.endswith(GAMES_EXTENSION):
+            try:
+                save_game_record(file_path, self.history, self.position_index)
+            # RecordError -> e.g. move counters too big for a record, the old save is kept
+            except ValueError as error:
+                print(f"Error: {error}, not saved")
+                return False
+            return True
         with open(file_path, "w") as file:
-            for i in range(self.position_index+1):
-                file.write(self.board_history[i]+'\n')
-
-    def load_game(self, file_path: str) -> str:
-        history = []
-        with open(file_path, "r") as file:
-            for line in file.readlines():
-                history.append(line.strip())
-        return history
+            if file_path.endswith(".pgn"):
+                file.write(get_PGN(self.history.moves[:self.position_index], self.history.snapshots[0]))
+                return True
+            for FEN_string in self.history.get_FENs(self.position_index):
+                file.write(FEN_string+'\n')
+        return True
+
+    def load_game(self, file_path: str) -> GameHistory:
+        try:
+            if file_path.endswith(".pgn"):
+                # the first game of the file
+                with open(file_path, "r") as file:
+                    return load_game_history(next(read_games(file), PGNGame()))
+            if file_path.endswith(GAMES_EXTENSION):
+                return load_game_record(file_path)
+
+            FEN_strings = []
+            with open(file_path, "r") as file:
+                for line in file.readlines():
+                    if line.strip():
+                        FEN_strings.append(line.strip())
+            return load_history(FEN_strings)
+        # PGNError, FENError and RecordError are all ValueErrors
+        except ValueError as error:
+            # a broken first position starts a new game instead
+            print(f"Error: {error}, starting a new game")
+            return GameHistory(START_FEN)
+
+    def render_background(self) -> pygame.Surface:
+        # squares and coordinates never change -> drawn once and copied back under whatever is on top
+        background = pygame.Surface(window.get_size(), 0, window)
 
-    def render_board(self) -> None:
         # Draw squares (white or black)
         for y in range(BOARD_HEIGHT):
             for x in range(BOARD_WIDTH):
                 square_sprite = SQUARE_SPRITES[0] if (x+y) % 2 == 0 else SQUARE_SPRITES[1]
-                window.blit(square_sprite, (x*SQUARE_SIZE, y*SQUARE_SIZE))
+                background.blit(square_sprite, (x*SQUARE_SIZE, y*SQUARE_SIZE))
 
         # Draw board coordinates
         for x in range(BOARD_WIDTH):
-            window.blit(FONT.render(RANKS[x], True, FONT_COLOUR), ((x)*SQUARE_SIZE+SQUARE_SIZE-FONT_SIZE/2, BOARD_HEIGHT*SQUARE_SIZE-FONT_SIZE))
+            background.blit(TEXT.render(RANKS[x], FONT_COLOUR), ((x)*SQUARE_SIZE+SQUARE_SIZE-FONT_SIZE/2, BOARD_HEIGHT*SQUARE_SIZE-FONT_SIZE))
         for y in range(BOARD_HEIGHT):
-            window.blit(FONT.render(FILES[y], True, FONT_COLOUR), (TEXT_OFFSET, y*SQUARE_SIZE+TEXT_OFFSET))
+            background.blit(TEXT.render(FILES[y], FONT_COLOUR), (TEXT_OFFSET, y*SQUARE_SIZE+TEXT_OFFSET))
 
-        # Draw highlight squares
-        if self.last_move is not None:
-            window.blit(SQUARE_SPRITES[3], (self.last_move.piece_x*SQUARE_SIZE, self.last_move.piece_y*SQUARE_SIZE))
-            window.blit(SQUARE_SPRITES[3], (self.last_move.target_x*SQUARE_SIZE, self.last_move.target_y*SQUARE_SIZE))
-        if self.selected_square is not None:
-            window.blit(SQUARE_SPRITES[2], (self.selected_square[0]*SQUARE_SIZE, self.selected_square[1]*SQUARE_SIZE))
+        return background
 
-        # Draw pieces on board
-        for y in range(BOARD_HEIGHT):
-            for x in range(BOARD_WIDTH):
-                piece = self.board.get_piece(x, y)
-                if piece is not None:
-                    colour = 0 if piece.colour == Colour.WHITE else 6
-                    piece_sprite = PIECE_SPRITES[piece.piece_type.value + colour]
-                    window.blit(piece_sprite, (x*SQUARE_SIZE, y*SQUARE_SIZE))
+    def get_square_states(self) -> list[tuple]:
+        # what every square should show -> (highlight sprites, piece sprite, symbol sprite)
+        highlights = [() for square in range(BOARD_WIDTH*BOARD_HEIGHT)]
+        symbols = [None for square in range(BOARD_WIDTH*BOARD_HEIGHT)]
 
-        # Draw symbols for selected piece moves
+        # Highlight squares
+        if self.last_move is not None:
+            highlights[self.last_move.piece_y*BOARD_WIDTH + self.last_move.piece_x] += (3,)
+            highlights[self.last_move.target_y*BOARD_WIDTH + self.last_move.target_x] += (3,)
         if self.selected_square is not None:
+            highlights[self.selected_square[1]*BOARD_WIDTH + self.selected_square[0]] += (2,)
+
+            # Symbols for selected piece moves
             for move in self.legal_moves:
                 if move.piece_x == self.selected_square[0] and move.piece_y == self.selected_square[1]:
-                    window.blit(SYMBOL_SPRITES[move.move_type.value], (move.target_x*SQUARE_SIZE, move.target_y*SQUARE_SIZE))
+                    symbols[move.target_y*BOARD_WIDTH + move.target_x] = move.move_type.value
+
+        # Pieces on board
+        square_states = []
+        for square, piece in enumerate(self.board.board):
+            piece_sprite = None
+            if piece is not None:
+                colour = 0 if piece.colour == Colour.WHITE else 6
+                piece_sprite = piece.piece_type.value + colour
+            square_states.append((highlights[square], piece_sprite, symbols[square]))
+
+        # Promotion picker covers whatever is under it
+        if self.promotion_moves:
+            colour = 0 if self.board.current_turn == Colour.WHITE else 6
+            for (x, y), move in zip(self.get_promotion_squares(), self.promotion_moves):
+                square_states[y*BOARD_WIDTH + x] = ((2,), move.promotion.value + colour, None)
+
+        return square_states
+
+    def render_board(self) -> None:
+        # only squares that look different from the last render are redrawn and pushed to the display
+        square_states = self.get_square_states()
+        dirty_rects = []
+        for square, square_state in enumerate(square_states):
+            if square_state == self.drawn_square_states[square]:
+                continue
+
+            rect = pygame.Rect((square % BOARD_WIDTH)*SQUARE_SIZE, (square // BOARD_WIDTH)*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+            highlights, piece_sprite, symbol = square_state
+            window.blit(self.background, rect, rect)
+            for highlight in highlights:
+                window.blit(SQUARE_SPRITES[highlight], rect)
+            if piece_sprite is not None:
+                window.blit(PIECE_SPRITES[piece_sprite], rect)
+            if symbol is not None:
+                window.blit(SYMBOL_SPRITES[symbol], rect)
+            dirty_rects.append(rect)
+
+        self.drawn_square_states = square_states
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+
+    def redraw(self) -> None:
+        # forgets what's on screen so the next render draws every square, e.g. after the window was covered
+        self.drawn_square_states = [None for square in range(BOARD_WIDTH*BOARD_HEIGHT)]
+        self.render_board()
+
+def search_in_background(engine: Engine, key: int) -> None:
+    # key is the position searched so the game can tell if the move still applies
+    best_move = engine.search(time_limit=SEARCH_TIME_LIMIT).best_move
+    pygame.event.post(pygame.event.Event(ENGINE_MOVE_EVENT, move=best_move, key=key))
 
 def screen_to_square(mouse_position) -> tuple[int]:
     return (int(mouse_position[0]/SQUARE_SIZE), int(mouse_position[1]/SQUARE_SIZE))
 
 def terminate() -> None:
+    save_sprite_caches()
     pygame.quit()
     raise SystemExit
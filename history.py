@@ -0,0 +1,86 @@
+from __future__ import annotations
+from array import array
+
+from board import Board
+from engine import Engine
+from fen import FENError
+from constants import SNAPSHOT_INTERVAL
+
+
+class GameHistory:
+    def __init__(self, start_FEN: str, snapshot_interval: int = SNAPSHOT_INTERVAL) -> None:
+        '''Moves of a game stored as packed ints, with a FEN snapshot every snapshot_interval plies to rebuild positions from'''
+        self.snapshot_interval = snapshot_interval
+        self.moves = array('I')
+        # hashes[i] is the zobrist key of the position before move i
+        self.hashes = array('Q')
+        # snapshots[i] is the position after i*snapshot_interval moves
+        self.snapshots = [start_FEN]
+
+    def __len__(self) -> int:
+        # number of positions, including the starting one
+        return len(self.moves) + 1
+
+    def append(self, move: int, board: Board) -> None:
+        '''Adds a move played from the last position, board is the position it led to after Engine.make_move'''
+        self.moves.append(move)
+        self.hashes.append(board.hash_stack[-1])
+        if len(self.moves) % self.snapshot_interval == 0:
+            self.snapshots.append(board.get_FEN())
+
+    def truncate(self, ply: int) -> None:
+        '''Drops every move after ply, e.g. when a different move is played from an earlier position'''
+        del self.moves[ply:]
+        del self.hashes[ply:]
+        del self.snapshots[ply // self.snapshot_interval + 1:]
+
+    def get_snapshot(self, ply: int) -> tuple[int, str]:
+        '''Returns (snapshot ply, FEN) of the nearest snapshot at or before ply'''
+        index = ply // self.snapshot_interval
+        return index*self.snapshot_interval, self.snapshots[index]
+
+    def get_hashes(self, ply: int, half_moves: int) -> list[int]:
+        '''Returns the hash stack of the position at ply, back as far as its last pawn move or capture'''
+        return self.hashes[max(ply-half_moves, 0):ply].tolist()
+
+    def get_FENs(self, last_ply: int = None) -> list[str]:
+        '''Returns the FEN of every position up to last_ply by replaying the moves'''
+        board = Board()
+        board.load_FEN(self.snapshots[0])
+        engine = Engine(board)
+
+        FEN_strings = [board.get_FEN()]
+        for move in self.moves[:last_ply]:
+            engine.make_move(move)
+            FEN_strings.append(board.get_FEN())
+        return FEN_strings
+
+
+def load_history(FEN_strings: list[str], snapshot_interval: int = SNAPSHOT_INTERVAL) -> GameHistory:
+    # positions are linked by finding the legal move that leads from each one to the next
+    history = GameHistory(FEN_strings[0], snapshot_interval)
+    board = Board()
+    board.load_FEN(FEN_strings[0])
+    engine = Engine(board)
+
+    next_board = Board()
+    for FEN_string in FEN_strings[1:]:
+        try:
+            next_board.load_FEN(FEN_string)
+        except FENError as error:
+            print(f"Error: {error}, history stops before it")
+            break
+
+        in_check, legal_moves = engine.generate_legal_moves()
+        for move in legal_moves:
+            previous_state = engine.make_move(move)
+            if board.hash == next_board.hash:
+                break
+            engine.unmake_move(move, previous_state)
+        else:
+            print(f"Error: No legal move leads to {FEN_string}, history stops before it")
+            break
+
+        history.append(move, board)
+
+    return history
@@ -0,0 +1,106 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from operator import itemgetter
+
+from constants import PieceType, MAX_PLY
+from pieces import SQUARE_MASK, TO_SHIFT, TYPE_FIELD, EN_PASSANT_FLAG, PROMOTION_FLAG, is_quiet, is_underpromotion
+
+if TYPE_CHECKING:
+    from array import array
+    from board import Board
+
+# Sort keys -> hash move, then captures and promotions, then killers, then quiet moves by history, then underpromotions
+HASH_MOVE_SCORE = 1_000_000
+CAPTURE_SCORE = 100_000
+KILLER_SCORES = (90_000, 80_000)
+HISTORY_LIMIT = 50_000
+UNDERPROMOTION_SCORE = -1
+
+# most valuable victim first, least valuable attacker to break ties -> MVV_LVA[victim][attacker]
+MVV_LVA = [[victim*len(PieceType) + (len(PieceType)-1 - attacker) for attacker in PieceType] for victim in PieceType]
+PROMOTION_SCORE = MVV_LVA[PieceType.QUEEN][PieceType.PAWN]
+EN_PASSANT_SCORE = MVV_LVA[PieceType.PAWN][PieceType.PAWN]
+
+
+class MoveOrdering:
+    def __init__(self) -> None:
+        '''Orders moves for the search and tracks the killer and history heuristics it learns from cutoffs'''
+        self.killers = [[0, 0] for ply in range(MAX_PLY+1)]
+        # history[colour][piece_type][target square]
+        self.history = [[[0]*64 for piece_type in PieceType] for colour in range(2)]
+
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self) -> None:
+        '''Forgets killers and statistics and halves history so old results count for less'''
+        self.killers = [[0, 0] for ply in range(MAX_PLY+1)]
+        self.age_history()
+
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def age_history(self) -> None:
+        for colour_history in self.history:
+            for piece_history in colour_history:
+                for square in range(64):
+                    piece_history[square] >>= 1
+
+    def order_moves(self, board: Board, moves: array, count: int, ply: int, hash_move: int = 0) -> list[int]:
+        '''Returns the first count moves of the buffer sorted with the most promising first'''
+        killers = self.killers[ply]
+        history = self.history[board.current_turn]
+        squares = board.board
+        scores = []
+        for index in range(count):
+            move = moves[index]
+            move_type = move & TYPE_FIELD
+            target = squares[move >> TO_SHIFT & SQUARE_MASK]
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            elif move_type == PROMOTION_FLAG and is_underpromotion(move):
+                # the queen promotion to the same square is almost always better
+                score = UNDERPROMOTION_SCORE
+            elif target is not None:
+                score = CAPTURE_SCORE + MVV_LVA[target.piece_type][squares[move & SQUARE_MASK].piece_type]
+                if move_type == PROMOTION_FLAG:
+                    score += PROMOTION_SCORE
+            elif move_type == PROMOTION_FLAG:
+                score = CAPTURE_SCORE + PROMOTION_SCORE
+            elif move_type == EN_PASSANT_FLAG:
+                score = CAPTURE_SCORE + EN_PASSANT_SCORE
+            elif move == killers[0]:
+                score = KILLER_SCORES[0]
+            elif move == killers[1]:
+                score = KILLER_SCORES[1]
+            else:
+                score = history[squares[move & SQUARE_MASK].piece_type][move >> TO_SHIFT & SQUARE_MASK]
+            scores.append(score)
+
+        return [move for score, move in sorted(zip(scores, moves[:count]), key=itemgetter(0), reverse=True)]
+
+    def update_cutoff(self, board: Board, move: int, ply: int, depth: int, move_index: int) -> None:
+        '''Records a beta cutoff caused by the move at move_index of the ordered list, called with the move unmade'''
+        self.cutoffs += 1
+        if move_index == 0:
+            self.first_move_cutoffs += 1
+
+        # captures and promotions are already ordered first so only quiet moves are remembered
+        if not is_quiet(move):
+            return
+
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+        piece = board.board[move & SQUARE_MASK]
+        piece_history = self.history[piece.colour][piece.piece_type]
+        target_square = move >> TO_SHIFT & SQUARE_MASK
+        piece_history[target_square] += depth*depth
+        if piece_history[target_square] > HISTORY_LIMIT:
+            self.age_history()
+
+    def get_first_move_cutoff_rate(self) -> float:
+        '''Fraction of beta cutoffs that came from the first move searched'''
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
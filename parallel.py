@@ -0,0 +1,198 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, Future
+from random import Random
+from time import perf_counter, time
+from os import cpu_count
+
+from board import Board
+from engine import Engine, SearchResult
+from transposition import TranspositionTable
+from pieces import get_move_notation
+from constants import MATE_SCORE, MAX_PLY
+
+# Each worker process keeps its own table between tasks -> nothing is shared between processes
+worker_table = None
+
+
+def start_worker(hash_size: int) -> None:
+    global worker_table
+    worker_table = TranspositionTable(hash_size) if hash_size > 0 else None
+
+def load_position(fen_string: str) -> Engine:
+    board = Board()
+    board.load_FEN(fen_string)
+    return Engine(board)
+
+def get_root_positions(fen_string: str) -> list[tuple[str, str]]:
+    # (move notation, FEN after the move) for every legal root move
+    engine = load_position(fen_string)
+    in_check, legal_moves = engine.generate_legal_moves()
+
+    root_positions = []
+    for move in legal_moves:
+        previous_state = engine.make_move(move)
+        root_positions.append((get_move_notation(move), engine.board.get_FEN()))
+        engine.unmake_move(move, previous_state)
+    return root_positions
+
+def get_moves_from_notation(engine: Engine, notations: list[str]) -> list[int]:
+    # replays notations from the engine's position to get the matching moves, leaving the board as it was
+    moves = []
+    previous_states = []
+    for notation in notations:
+        in_check, legal_moves = engine.generate_legal_moves()
+        move = next((move for move in legal_moves if get_move_notation(move) == notation), None)
+        if move is None:
+            break
+        previous_states.append(engine.make_move(move))
+        moves.append(move)
+
+    for move, previous_state in zip(reversed(moves), reversed(previous_states)):
+        engine.unmake_move(move, previous_state)
+    return moves
+
+def count_subtree(fen_string: str, depth: int) -> int:
+    return load_position(fen_string).perft(depth, worker_table)
+
+def parallel_divide(fen_string: str, depth: int, workers: int = None, hash_size: int = 0) -> dict[str, int]:
+    # every root move's subtree is counted by whichever worker process is free next
+    root_positions = get_root_positions(fen_string)
+    notations = [notation for notation, child_fen in root_positions]
+    child_fens = [child_fen for notation, child_fen in root_positions]
+
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(hash_size,)) as executor:
+        counts = executor.map(count_subtree, child_fens, [depth-1]*len(child_fens))
+        return dict(zip(notations, counts))
+
+def parallel_perft(fen_string: str, depth: int, workers: int = None, hash_size: int = 0) -> int:
+    return sum(parallel_divide(fen_string, depth, workers, hash_size).values())
+
+def search_subtree(fen_string: str, depth: int, deadline: float = None, seed: int = 0, beta: int = MATE_SCORE) -> tuple[int, int, list[str], int, bool]:
+    # deadline is wall clock time so every process agrees on it, the last value says whether depth was finished in time
+    time_limit = None
+    if deadline is not None:
+        time_limit = deadline - time()
+        # queued behind other tasks until the time was up -> not worth starting
+        if time_limit <= 0:
+            return 0, 0, [], 0, False
+
+    engine = load_position(fen_string)
+    engine.table = worker_table
+
+    # helpers start from differently shuffled quiet move orders so they don't all search the same tree
+    if seed:
+        generator = Random(seed)
+        for colour_history in engine.ordering.history:
+            for piece_history in colour_history:
+                for square in range(64):
+                    piece_history[square] = generator.randrange(64)
+
+    result = engine.search(depth, time_limit, beta=beta)
+    principal_variation = [get_move_notation(move) for move in result.principal_variation]
+    return result.score, result.depth, principal_variation, result.nodes, not engine.stopped
+
+def parallel_search(fen_string: str, depth: int = None, time_limit: float = None, workers: int = None, lazy: bool = False, hash_size: int = 16) -> SearchResult:
+    # checked before any workers start, root split search would otherwise deepen until MAX_PLY
+    if depth is None and time_limit is None:
+        raise ValueError("Search needs a depth, a time limit or both")
+    start_time = perf_counter()
+    engine = load_position(fen_string)
+
+    if lazy:
+        result = lazy_search(fen_string, depth, time_limit, workers, hash_size)
+    elif depth is not None and depth < 2:
+        # nothing below the root to split up
+        return engine.search(depth, time_limit)
+    else:
+        result = root_split_search(fen_string, depth, time_limit, workers, hash_size)
+
+    score, result_depth, notations, nodes = result
+    principal_variation = get_moves_from_notation(engine, notations)
+    best_move = principal_variation[0] if principal_variation else None
+    return SearchResult(best_move, score, result_depth, principal_variation, nodes, perf_counter() - start_time)
+
+def root_split_search(fen_string: str, depth: int, time_limit: float, workers: int, hash_size: int) -> tuple[int, int, list[str], int]:
+    # iterative deepening over the root moves -> every root move is searched to one depth before any goes deeper,
+    # so only results from the same depth are compared and a round cut off by the time limit is thrown away
+    root_positions = get_root_positions(fen_string)
+    if not root_positions:
+        in_check = load_position(fen_string).generate_legal_moves()[0]
+        return (-MATE_SCORE if in_check else 0), 0, [], 0
+
+    deadline = None if time_limit is None else time() + time_limit
+    max_depth = MAX_PLY if depth is None else min(depth, MAX_PLY)
+    workers = workers or cpu_count() or 1
+
+    # a one ply search in this process is the result until a round finishes
+    first_result = load_position(fen_string).search(1)
+    best_score, best_depth, best_variation = first_result.score, first_result.depth, [get_move_notation(move) for move in first_result.principal_variation]
+    total_nodes = first_result.nodes
+
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(hash_size,)) as executor:
+        for round_depth in range(2, max_depth+1):
+            # the best move of the last round goes first -> its score then bounds every other move
+            root_positions.sort(key=lambda root_position: root_position[0] != best_variation[0])
+            round_result, nodes = search_round(executor, root_positions, round_depth-1, deadline)
+            total_nodes += nodes
+            if round_result is None:
+                break
+            best_score, best_depth, best_variation = round_result
+
+            # found a forced mate, searching deeper won't change it
+            if abs(best_score) >= MATE_SCORE - MAX_PLY:
+                break
+
+    return best_score, best_depth, best_variation, total_nodes
+
+def search_round(executor: ProcessPoolExecutor, root_positions: list[tuple[str, str]], child_depth: int,
+                 deadline: float = None) -> tuple[tuple[int, int, list[str]] | None, int]:
+    # (score, depth, variation) of the best root move, or None if the deadline cut the round short, and the nodes searched
+    notation, child_fen = root_positions[0]
+    best_score, best_depth, best_variation, total_nodes, complete = get_root_score(notation, executor.submit(search_subtree, child_fen, child_depth, deadline))
+    if not complete:
+        return None, total_nodes
+
+    # the rest only have to prove they're worse than the first move, a reply scoring -best_score or more already does
+    futures = [executor.submit(search_subtree, child_fen, child_depth, deadline, 0, -best_score) for notation, child_fen in root_positions[1:]]
+    for (notation, child_fen), future in zip(root_positions[1:], futures):
+        score, result_depth, principal_variation, nodes, complete = get_root_score(notation, future)
+        total_nodes += nodes
+        if not complete:
+            # tasks that haven't started are dropped, running ones stop at the deadline by themselves
+            for future in futures:
+                future.cancel()
+            return None, total_nodes
+        if score > best_score:
+            best_score, best_depth, best_variation = score, result_depth, principal_variation
+
+    return (best_score, best_depth, best_variation), total_nodes
+
+def get_root_score(notation: str, future: Future) -> tuple[int, int, list[str], int, bool]:
+    # turns a child's result into one for the root move leading to it
+    child_score, child_depth, child_variation, nodes, complete = future.result()
+
+    score = -child_score
+    # mate scores are one ply further from the root than from the child
+    if score >= MATE_SCORE - MAX_PLY:
+        score -= 1
+    elif score <= -MATE_SCORE + MAX_PLY:
+        score += 1
+
+    return score, child_depth+1, [notation] + child_variation, nodes, complete
+
+def lazy_search(fen_string: str, depth: int, time_limit: float, workers: int, hash_size: int) -> tuple[int, int, list[str], int]:
+    # every worker searches the whole position independently, the deepest finished result wins
+    workers = workers or cpu_count() or 1
+    deadline = None if time_limit is None else time() + time_limit
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(hash_size,)) as executor:
+        futures = []
+        for worker_index in range(workers):
+            # half the helpers aim a ply deeper when searching to a fixed depth
+            worker_depth = None if depth is None else depth + worker_index % 2
+            futures.append(executor.submit(search_subtree, fen_string, worker_depth, deadline, worker_index))
+
+        results = [future.result() for future in futures]
+
+    total_nodes = sum(nodes for score, result_depth, principal_variation, nodes, complete in results)
+    score, result_depth, principal_variation, nodes, complete = max(results, key=lambda result: (result[1], result[0]))
+    return score, result_depth, principal_variation, total_nodes
@@ -0,0 +1,301 @@
+from __future__ import annotations
+from typing import Iterator, TextIO
+from dataclasses import dataclass, field
+from time import perf_counter
+import argparse
+import re
+
+from board import Board
+from engine import Engine
+from history import GameHistory
+from pieces import SQUARE_MASK, TO_SHIFT, PROMOTION_SHIFT, TYPE_FIELD, CAPTURE_FLAG, EN_PASSANT_FLAG, PROMOTION_FLAG, CASTLE_KING_SIDE_FLAG, CASTLE_QUEEN_SIDE_FLAG
+from constants import Colour, PieceType, BOARD_WIDTH, START_FEN, RANKS, FILES
+
+SAN_PIECES = {'N': PieceType.KNIGHT, 'B': PieceType.BISHOP, 'R': PieceType.ROOK, 'Q': PieceType.QUEEN, 'K': PieceType.KING}
+PIECE_TO_SAN = {piece_type: char for char, piece_type in SAN_PIECES.items()}
+SQUARE_NAMES = [f"{RANKS[square % BOARD_WIDTH]}{FILES[square // BOARD_WIDTH]}" for square in range(64)]
+SQUARE_INDEXES = {name: square for square, name in enumerate(SQUARE_NAMES)}
+# piece, from file, from rank, capture, target square, promotion -> e.g. Nbd7, exd6, R1xa3, e8=Q (e8Q is accepted too)
+SAN_PATTERN = re.compile(r"([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?")
+# check, mate and annotation marks are ignored when reading
+SAN_SUFFIXES = "+#!?"
+CASTLING_SAN = {"O-O": CASTLE_KING_SIDE_FLAG, "O-O-O": CASTLE_QUEEN_SIDE_FLAG, "0-0": CASTLE_KING_SIDE_FLAG, "0-0-0": CASTLE_QUEEN_SIDE_FLAG}
+
+# comments, variation brackets, NAGs, move numbers and everything else as a move or result
+MOVETEXT_TOKENS = re.compile(r"\{[^}]*\}?|;[^\n]*|[()]|\$\d+|\d+\.+|[^\s(){};]+")
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TAG_ESCAPES = re.compile(r"\\(.)")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# the seven tag roster comes first in every exported game, in this order
+ROSTER = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?", "White": "?", "Black": "?", "Result": "*"}
+LINE_LENGTH = 79
+
+
+class PGNError(ValueError):
+    def __init__(self, message: str, move_text: str = None) -> None:
+        '''Raised for a move that can't be read in the current position or a game that can't be replayed'''
+        super().__init__(message if move_text is None else f"{message}: {move_text}")
+        self.move_text = move_text
+
+@dataclass (slots=True)
+class PGNGame:
+    # a game as read from a file, moves are still SAN text until replayed
+    tags: dict[str, str] = field(default_factory=dict)
+    moves: list[str] = field(default_factory=list)
+    result: str = "*"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file, optionally writing them back out")
+    parser.add_argument("games", help="PGN file with any number of games")
+    parser.add_argument("--output", metavar="FILE", help="write each replayed game here as PGN")
+    args = parser.parse_args()
+
+    engine = Engine(Board())
+    games = plies = errors = 0
+    output_file = open(args.output, "w") if args.output else None
+    start_time = perf_counter()
+    with open(args.games) as pgn_file:
+        for game in read_games(pgn_file):
+            games += 1
+            try:
+                moves = replay_game(engine, game)
+            except ValueError as error:
+                # a broken game is reported and skipped, FENError from a bad FEN tag included
+                errors += 1
+                print(f"Error: game {games}, {error}")
+                continue
+            plies += len(moves)
+            if output_file is not None:
+                # the result at the end of the movetext stands in for a missing Result tag
+                output_file.write(get_PGN(moves, game.tags.get("FEN", START_FEN), {"Result": game.result, **game.tags}) + '\n')
+    elapsed_time = perf_counter() - start_time
+    if output_file is not None:
+        output_file.close()
+
+    print(f"games: {games}, errors: {errors}, plies: {plies}, time: {elapsed_time:.3f}s, "
+          f"games/s: {int(games / max(elapsed_time, 1e-9))}, plies/s: {int(plies / max(elapsed_time, 1e-9))}")
+
+
+def get_SAN(engine: Engine, move: int) -> str:
+    # move has to be legal in the engine's position
+    board = engine.board.board
+    move_type = move & TYPE_FIELD
+    from_square = move & SQUARE_MASK
+    to_square = move >> TO_SHIFT & SQUARE_MASK
+    piece_type = board[from_square].piece_type
+
+    if move_type == CASTLE_KING_SIDE_FLAG:
+        san = "O-O"
+    elif move_type == CASTLE_QUEEN_SIDE_FLAG:
+        san = "O-O-O"
+    else:
+        is_capture = move_type == CAPTURE_FLAG or move_type == EN_PASSANT_FLAG or board[to_square] is not None
+        if piece_type == PieceType.PAWN:
+            san = f"{SQUARE_NAMES[from_square][0]}x" if is_capture else ""
+        else:
+            san = PIECE_TO_SAN[piece_type] + get_disambiguation(engine, move) + ("x" if is_capture else "")
+        san += SQUARE_NAMES[to_square]
+        if move_type == PROMOTION_FLAG:
+            san += "=" + PIECE_TO_SAN[PieceType(move >> PROMOTION_SHIFT & 7)]
+
+    # check and mate marks need the reply position, replies are only generated to tell the two apart
+    previous_state = engine.make_move(move)
+    king = engine.board.pieces[engine.board.current_turn][0]
+    if engine.is_attacked(king.x, king.y, engine.board.opponent_turn):
+        in_check, replies = engine.generate_legal_moves()
+        san += "+" if replies else "#"
+    engine.unmake_move(move, previous_state)
+    return san
+
+def get_disambiguation(engine: Engine, move: int) -> str:
+    # file if that's enough, else rank, else both
+    board = engine.board.board
+    from_square = move & SQUARE_MASK
+    to_square = move >> TO_SHIFT & SQUARE_MASK
+    piece_type = board[from_square].piece_type
+
+    # only moves to the same square can clash
+    in_check, legal_moves = engine.generate_legal_moves(1 << to_square)
+    others = [other & SQUARE_MASK for other in legal_moves
+              if other >> TO_SHIFT & SQUARE_MASK == to_square and other & SQUARE_MASK != from_square and board[other & SQUARE_MASK].piece_type == piece_type]
+    if not others:
+        return ""
+    if all(other % BOARD_WIDTH != from_square % BOARD_WIDTH for other in others):
+        return SQUARE_NAMES[from_square][0]
+    if all(other // BOARD_WIDTH != from_square // BOARD_WIDTH for other in others):
+        return SQUARE_NAMES[from_square][1]
+    return SQUARE_NAMES[from_square]
+
+def parse_SAN(engine: Engine, san: str) -> int:
+    # returns the one legal move san describes in the engine's position
+    text = san.rstrip(SAN_SUFFIXES)
+    if text.endswith("e.p."):
+        text = text[:-4]
+
+    if text in CASTLING_SAN:
+        flag = CASTLING_SAN[text]
+        in_check, legal_moves = engine.generate_legal_moves()
+        for move in legal_moves:
+            if move & TYPE_FIELD == flag:
+                return move
+        raise PGNError("Illegal castle", san)
+
+    match = SAN_PATTERN.fullmatch(text)
+    if match is None:
+        raise PGNError("Unreadable move", san)
+    piece, from_file, from_rank, capture, target, promotion = match.groups()
+    piece_type = SAN_PIECES[piece] if piece else PieceType.PAWN
+    to_square = SQUARE_INDEXES[target]
+    promotion_type = SAN_PIECES[promotion] if promotion else None
+
+    # only moves landing on the target square are generated
+    in_check, legal_moves = engine.generate_legal_moves(1 << to_square)
+    board = engine.board.board
+    found = None
+    for move in legal_moves:
+        if move >> TO_SHIFT & SQUARE_MASK != to_square:
+            continue
+        from_square = move & SQUARE_MASK
+        if board[from_square].piece_type != piece_type:
+            continue
+        if from_file is not None and SQUARE_NAMES[from_square][0] != from_file:
+            continue
+        if from_rank is not None and SQUARE_NAMES[from_square][1] != from_rank:
+            continue
+        if move & TYPE_FIELD == PROMOTION_FLAG:
+            if promotion_type is None or move >> PROMOTION_SHIFT & 7 != promotion_type:
+                continue
+        elif promotion_type is not None:
+            continue
+        if found is not None:
+            raise PGNError("Ambiguous move", san)
+        found = move
+
+    if found is None:
+        raise PGNError("Illegal move", san)
+    return found
+
+def read_games(pgn_file: TextIO) -> Iterator[PGNGame]:
+    # one game at a time, only the game being read is held in memory
+    game = PGNGame()
+    movetext = []
+    for line in pgn_file:
+        if line.startswith('%'):
+            continue
+        stripped = line.strip()
+        if stripped.startswith('[') and not is_inside_comment(movetext):
+            # tags after moves start the next game
+            if movetext:
+                yield finish_game(game, movetext)
+                game = PGNGame()
+                movetext = []
+            tag = TAG_PATTERN.match(stripped)
+            if tag is not None:
+                game.tags[tag.group(1)] = TAG_ESCAPES.sub(r"\1", tag.group(2))
+        elif stripped or movetext:
+            movetext.append(line)
+
+    if movetext or game.tags:
+        yield finish_game(game, movetext)
+
+def is_inside_comment(movetext: list[str]) -> bool:
+    # a brace comment can run over several lines, anything in it is not a tag
+    if not movetext:
+        return False
+    text = ''.join(movetext)
+    return text.rfind('{') > text.rfind('}')
+
+def finish_game(game: PGNGame, movetext: list[str]) -> PGNGame:
+    # moves of the main line, comments, NAGs and variations are dropped
+    variation_depth = 0
+    for token in MOVETEXT_TOKENS.findall(''.join(movetext)):
+        first = token[0]
+        if first == '(':
+            variation_depth += 1
+        elif first == ')':
+            variation_depth = max(variation_depth-1, 0)
+        elif variation_depth or first == '{' or first == ';' or first == '$' or (first.isdigit() and token[-1] == '.'):
+            continue
+        elif token in RESULTS:
+            game.result = token
+        else:
+            game.moves.append(token)
+    return game
+
+def replay_game(engine: Engine, game: PGNGame, history: GameHistory = None) -> list[int]:
+    # plays the game out on the engine's board from its FEN tag or the start, the board is reused rather than rebuilt each ply
+    engine.board.load_FEN(game.tags.get("FEN", START_FEN))
+    moves = []
+    for san in game.moves:
+        move = parse_SAN(engine, san)
+        engine.make_move(move)
+        moves.append(move)
+        if history is not None:
+            history.append(move, engine.board)
+    return moves
+
+def load_game_history(game: PGNGame) -> GameHistory:
+    # a move that can't be read ends the history there, like a bad line of a FEN file
+    history = GameHistory(game.tags.get("FEN", START_FEN))
+    try:
+        replay_game(Engine(Board()), game, history)
+    except PGNError as error:
+        print(f"Error: {error}, history stops before it")
+    return history
+
+def get_result(engine: Engine) -> str:
+    # only a finished game on the board has a result
+    in_check, legal_moves = engine.generate_legal_moves()
+    if legal_moves:
+        return "*" if engine.get_draw() is None else "1/2-1/2"
+    if not in_check:
+        return "1/2-1/2"
+    return "0-1" if engine.board.current_turn == Colour.WHITE else "1-0"
+
+def get_PGN(moves: list[int], start_FEN: str = START_FEN, tags: dict[str, str] = None) -> str:
+    board = Board()
+    board.load_FEN(start_FEN)
+    engine = Engine(board)
+
+    tokens = []
+    for move in moves:
+        if board.current_turn == Colour.WHITE:
+            tokens.append(f"{board.full_moves}.")
+        elif not tokens:
+            # a game starting with black's move still numbers it
+            tokens.append(f"{board.full_moves}...")
+        tokens.append(get_SAN(engine, move))
+        engine.make_move(move)
+
+    tags = {**ROSTER, **(tags or {})}
+    if tags["Result"] == "*":
+        tags["Result"] = get_result(engine)
+    if start_FEN != START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_FEN
+    tokens.append(tags["Result"])
+
+    lines = [f'[{name} "{escape_tag(value)}"]' for name, value in tags.items()]
+    lines.append("")
+    lines.extend(wrap_tokens(tokens))
+    return '\n'.join(lines) + '\n'
+
+def escape_tag(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def wrap_tokens(tokens: list[str]) -> list[str]:
+    lines = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    if line:
+        lines.append(line)
+    return lines
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,45 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from dataclasses import dataclass
+from array import array
 
-from constants import Colour, PieceType, MoveType
+from constants import Colour, PieceType, MoveType, RANKS, FILES, BOARD_WIDTH, MAX_MOVES, PIECE_TO_STRING
+from bitboards import FULL, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BISHOP_RAYS, ROOK_RAYS, QUEEN_RAYS, get_sliding_attacks, get_squares
 
 if TYPE_CHECKING:
     from board import Board
 
+# Moves are packed into ints -> from square (bits 0-5), to square (6-11), move type (12-14), promotion piece type (15-17)
+SQUARE_MASK = 63
+TO_SHIFT = 6
+TYPE_SHIFT = 12
+PROMOTION_SHIFT = 15
+
+# move type fields already shifted into place -> hot code tests move & TYPE_FIELD against these without enum lookups
+TYPE_FIELD = 7 << TYPE_SHIFT
+PROMOTION_FIELD = 7 << PROMOTION_SHIFT
+MOVE_FLAG = MoveType.MOVE << TYPE_SHIFT
+CAPTURE_FLAG = MoveType.CAPTURE << TYPE_SHIFT
+DOUBLE_PUSH_FLAG = MoveType.DOUBLE_PUSH << TYPE_SHIFT
+EN_PASSANT_FLAG = MoveType.EN_PASSANT << TYPE_SHIFT
+PROMOTION_FLAG = MoveType.PROMOTION << TYPE_SHIFT
+CASTLE_QUEEN_SIDE_FLAG = MoveType.CASTLE_QUEEN_SIDE << TYPE_SHIFT
+CASTLE_KING_SIDE_FLAG = MoveType.CASTLE_KING_SIDE << TYPE_SHIFT
+QUEEN_PROMOTION_FLAG = PROMOTION_FLAG | PieceType.QUEEN << PROMOTION_SHIFT
+# most useful first -> underpromotions only matter for the odd stalemate or knight fork
+PROMOTION_FLAGS = tuple(PROMOTION_FLAG | piece_type << PROMOTION_SHIFT for piece_type in (PieceType.QUEEN, PieceType.KNIGHT, PieceType.ROOK, PieceType.BISHOP))
+
 
 @dataclass (slots=True)
 class Move:
+    # decoded view of a packed move for the interface, the engine only passes the ints around
+    move: int
     move_type: MoveType
-    piece: Piece
     piece_x: int
     piece_y: int
-    target: Piece
     target_x: int
     target_y: int
+    promotion: PieceType
 
 @dataclass (slots=True)
 class Piece:
@@ -27,138 +50,151 @@ class Piece:
     alive: bool
 
 
-def get_moves(board: Board, piece: Piece):
+def create_move_buffer() -> array:
+    # moves are generated into these preallocated buffers, one per ply, rather than into fresh lists
+    return array('I', bytes(4*MAX_MOVES))
+
+def decode_move(move: int) -> Move:
+    from_square = get_from_square(move)
+    to_square = get_to_square(move)
+    return Move(move, get_move_type(move), from_square % BOARD_WIDTH, from_square // BOARD_WIDTH,
+                to_square % BOARD_WIDTH, to_square // BOARD_WIDTH, get_promotion(move))
+
+def get_from_square(move: int) -> int:
+    return move & SQUARE_MASK
+
+def get_to_square(move: int) -> int:
+    return move >> TO_SHIFT & SQUARE_MASK
+
+def get_move_type(move: int) -> MoveType:
+    return MoveType(move >> TYPE_SHIFT & 7)
+
+def get_promotion(move: int) -> PieceType:
+    return PieceType(move >> PROMOTION_SHIFT & 7)
+
+def is_quiet(move: int) -> bool:
+    # captures, en passant and promotions all change material
+    move_type = move & TYPE_FIELD
+    return move_type != CAPTURE_FLAG and move_type != EN_PASSANT_FLAG and move_type != PROMOTION_FLAG
+
+def is_underpromotion(move: int) -> bool:
+    return move & TYPE_FIELD == PROMOTION_FLAG and move & (TYPE_FIELD | PROMOTION_FIELD) != QUEEN_PROMOTION_FLAG
+
+def get_move_notation(move: int) -> str:
+    from_square = get_from_square(move)
+    to_square = get_to_square(move)
+    notation = (f"{RANKS[from_square % BOARD_WIDTH]}{FILES[from_square // BOARD_WIDTH]}"
+                f"{RANKS[to_square % BOARD_WIDTH]}{FILES[to_square // BOARD_WIDTH]}")
+    # promotions name the new piece, e.g. e7e8n
+    if move & TYPE_FIELD == PROMOTION_FLAG:
+        notation += PIECE_TO_STRING[get_promotion(move)]
+    return notation
+
+def get_moves(board: Board, piece: Piece, moves: array, count: int, allowed: int = FULL) -> int:
+    # moves are written into the buffer from count onwards and the new count is returned
+    # allowed masks the target squares -> used to keep pinned pieces on their pin and to block or capture checks
     match piece.piece_type:
         case PieceType.PAWN:
-            return get_pawn_moves(board, piece)
+            return get_pawn_moves(board, piece, moves, count, allowed)
+        case PieceType.KING:
+            # king safety can't be masked ahead of time, the engine checks each target square
+            return get_king_moves(board, piece, moves, count)
+        case _:
+            return get_attack_moves(board, piece, get_attacks(board, piece, board.get_occupied()) & allowed, moves, count)
+
+def get_attacks(board: Board, piece: Piece, occupied: int) -> int:
+    square = piece.y*board.width + piece.x
+    match piece.piece_type:
+        case PieceType.PAWN:
+            return PAWN_ATTACKS[piece.colour][square]
         case PieceType.KNIGHT:
-            return get_knight_moves(board, piece)
+            return KNIGHT_ATTACKS[square]
         case PieceType.BISHOP:
-            return get_bishop_moves(board, piece)
+            return get_sliding_attacks(square, BISHOP_RAYS, occupied)
         case PieceType.ROOK:
-            return get_rook_moves(board, piece)
+            return get_sliding_attacks(square, ROOK_RAYS, occupied)
         case PieceType.QUEEN:
-            return get_queen_moves(board, piece)
+            return get_sliding_attacks(square, QUEEN_RAYS, occupied)
         case PieceType.KING:
-            return get_king_moves(board, piece)
+            return KING_ATTACKS[square]
 
-def get_pawn_moves(board: Board, piece: Piece) -> list[Move]:
+def get_pawn_moves(board: Board, piece: Piece, moves: array, count: int, allowed: int = FULL) -> int:
     direction = -1 if piece.colour == Colour.WHITE else 1
-    pseudo_legal_moves = []
+    square = piece.y*board.width + piece.x
 
-    new_x = piece.x
+    occupied = board.get_occupied()
     new_y = piece.y + direction
-
     is_promotion = new_y == board.height-1 or new_y == 0
 
     # forward one
-    if board.inside_board(new_x, new_y) and board.get_piece(new_x, new_y) is None:
+    push_square = new_y*board.width + piece.x
+    if not occupied >> push_square & 1:
         # move
-        pseudo_legal_moves.append(Move(MoveType.PROMOTION if is_promotion else MoveType.MOVE, piece, piece.x, piece.y, None, new_x, new_y))
+        if allowed >> push_square & 1:
+            if is_promotion:
+                for flag in PROMOTION_FLAGS:
+                    moves[count] = square | push_square << TO_SHIFT | flag
+                    count += 1
+            else:
+                moves[count] = square | push_square << TO_SHIFT
+                count += 1
 
         # forward two
-        if piece.y == 1 or piece.y == board.height-2:
-            if board.inside_board(new_x, new_y+direction) and board.get_piece(new_x, new_y+direction) is None:
-                pseudo_legal_moves.append(Move(MoveType.DOUBLE_PUSH, piece, piece.x, piece.y, None, new_x, new_y+direction))
+        start_y = board.height-2 if piece.colour == Colour.WHITE else 1
+        double_push_square = push_square + direction*board.width
+        if piece.y == start_y and not occupied >> double_push_square & 1 and allowed >> double_push_square & 1:
+            moves[count] = square | double_push_square << TO_SHIFT | DOUBLE_PUSH_FLAG
+            count += 1
 
     # captures
-    for side in (-1,1):
-        new_x = piece.x + (direction * side)
-        if board.inside_board(new_x, new_y):
-            target = board.get_piece(new_x, new_y)
-            if target is not None and target.colour != piece.colour:
-                pseudo_legal_moves.append(Move(MoveType.PROMOTION if is_promotion else MoveType.CAPTURE, piece, piece.x, piece.y, target, new_x, new_y))
-
-            if new_x == board.enpassant_target[0] and new_y == board.enpassant_target[1] and board.enpassant_target[2].colour != piece.colour:
-                pseudo_legal_moves.append(Move(MoveType.EN_PASSANT, piece, piece.x, piece.y, board.enpassant_target[2], new_x, new_y))
-
-    return pseudo_legal_moves
-
-def get_knight_moves(board: Board, piece: Piece) -> list[Move]:
-    moves = ((2,-1),(2,1),(-1,-2),(1,-2),(-2,-1),(-2,1),(1,2),(-1,2))
-    return get_set_moves(board, moves, piece)
-
-def get_bishop_moves(board: Board, piece: Piece) -> list[Move]:
-    sliding_moves = ((-1,-1),(-1,1),(1,-1),(1,1))
-    return get_sliding_moves(board, sliding_moves, piece)
-
-def get_rook_moves(board: Board, piece: Piece) -> list[Move]:
-    sliding_moves = ((0,-1),(-1,0),(1,0),(0,1))
-    return get_sliding_moves(board, sliding_moves, piece)
-
-def get_queen_moves(board: Board, piece: Piece) -> list[Move]:
-    sliding_moves = ((-1,-1),(0,-1),(1,-1),(-1,0),(1,0),(-1,1),(0,1),(1,1))
-    return get_sliding_moves(board, sliding_moves, piece)
-
-def get_king_moves(board: Board, piece: Piece) -> list[Move]:
-    moves = ((-1,-1),(0,-1),(1,-1),(-1,0),(1,0),(-1,1),(0,1),(1,1))
-    castling_moves = []
-
-    new_x = piece.x
-    # castle kingside
-    if board.castling_rights[piece.colour][0]:
-        empty = True
-        for i in range(2):
-            new_x += 1
-            if not board.inside_board(new_x, piece.y) or board.get_piece(new_x, piece.y) is not None:
-                empty = False
-                break
-        if empty:
-            castling_moves.append(Move(MoveType.CASTLE_KING_SIDE, piece, piece.x, piece.y, None, new_x, piece.y))
-
-    new_x = piece.x
-    # castle queenside
-    if board.castling_rights[piece.colour][1]:
-        empty = True
-        for i in range(3):
-            new_x -= 1
-            if not board.inside_board(new_x, piece.y) or board.get_piece(new_x, piece.y) is not None:
-                empty = False
-                break
-        if empty:
-            castling_moves.append(Move(MoveType.CASTLE_QUEEN_SIDE, piece, piece.x, piece.y, None, new_x+1, piece.y))
-
-    return get_set_moves(board, moves, piece) + castling_moves
-
-def get_sliding_moves(board: Board, sliding_moves: tuple[tuple], piece: Piece) -> list[Move]:
-    pseudo_legal_moves = []
-
-    for direction in sliding_moves:
-        new_x = piece.x + direction[0]
-        new_y = piece.y + direction[1]
-
-        # moves
-        while board.inside_board(new_x, new_y) and board.get_piece(new_x, new_y) is None:
-            pseudo_legal_moves.append(Move(MoveType.MOVE, piece, piece.x, piece.y, None, new_x, new_y))
-            new_x += direction[0]
-            new_y += direction[1]
-
-        # captures
-        if not board.inside_board(new_x, new_y):
-            continue
-
-        target = board.get_piece(new_x, new_y)
-        if target.colour != piece.colour:
-            pseudo_legal_moves.append(Move(MoveType.CAPTURE, piece, piece.x, piece.y, target, new_x, new_y))
-
-    return pseudo_legal_moves
-
-def get_set_moves(board: Board, moves: tuple[tuple], piece: Piece) -> list[Move]:
-    pseudo_legal_moves = []
-
-    for move in moves:
-        new_x = piece.x + move[0]
-        new_y = piece.y + move[1]
-
-        # moves and captures
-        if not board.inside_board(new_x, new_y):
-            continue
-
-        target = board.get_piece(new_x, new_y)
-
-        if target is None:
-            pseudo_legal_moves.append(Move(MoveType.MOVE, piece, piece.x, piece.y, target, new_x, new_y))
-        elif target.colour != piece.colour:
-            pseudo_legal_moves.append(Move(MoveType.CAPTURE, piece, piece.x, piece.y, target, new_x, new_y))
-
-    return pseudo_legal_moves
+    attacks = PAWN_ATTACKS[piece.colour][square]
+    for target_square in get_squares(attacks & board.occupancy[piece.colour ^ 1] & allowed):
+        if is_promotion:
+            for flag in PROMOTION_FLAGS:
+                moves[count] = square | target_square << TO_SHIFT | flag
+                count += 1
+        else:
+            moves[count] = square | target_square << TO_SHIFT | CAPTURE_FLAG
+            count += 1
+
+    # en passant isn't masked as it can uncover an attack along the rank, the engine checks it on its own
+    enpassant_x, enpassant_y, enpassant_pawn = board.enpassant_target
+    enpassant_square = enpassant_y*board.width + enpassant_x
+    if enpassant_pawn is not None and enpassant_pawn.colour != piece.colour and attacks >> enpassant_square & 1:
+        moves[count] = square | enpassant_square << TO_SHIFT | EN_PASSANT_FLAG
+        count += 1
+
+    return count
+
+def get_king_moves(board: Board, piece: Piece, moves: array, count: int) -> int:
+    square = piece.y*board.width + piece.x
+    square_bit = 1 << square
+    occupied = board.get_occupied()
+
+    count = get_attack_moves(board, piece, KING_ATTACKS[square], moves, count)
+
+    # castle kingside -> two squares right of king must be empty
+    if board.castling_rights[piece.colour][0] and not (square_bit << 1 | square_bit << 2) & occupied:
+        moves[count] = square | (square+2) << TO_SHIFT | CASTLE_KING_SIDE_FLAG
+        count += 1
+
+    # castle queenside -> three squares left of king must be empty
+    if board.castling_rights[piece.colour][1] and not (square_bit >> 1 | square_bit >> 2 | square_bit >> 3) & occupied:
+        moves[count] = square | (square-2) << TO_SHIFT | CASTLE_QUEEN_SIDE_FLAG
+        count += 1
+
+    return count
+
+def get_attack_moves(board: Board, piece: Piece, attacks: int, moves: array, count: int) -> int:
+    square = piece.y*board.width + piece.x
+    enemies = board.occupancy[piece.colour ^ 1]
+
+    # captures and moves -> can't land on own pieces
+    for target_square in get_squares(attacks & enemies):
+        moves[count] = square | target_square << TO_SHIFT | CAPTURE_FLAG
+        count += 1
+    for target_square in get_squares(attacks & ~(enemies | board.occupancy[piece.colour])):
+        moves[count] = square | target_square << TO_SHIFT
+        count += 1
+
+    return count
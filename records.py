@@ -0,0 +1,375 @@
+from __future__ import annotations
+from typing import Iterator, Iterable
+from array import array
+import argparse
+import struct
+import mmap
+import sys
+import os
+
+from board import Board
+from engine import Engine
+from history import GameHistory, load_history
+from fen import FENPosition, PositionError, PIECE_TO_CHAR, validate_position, get_pieces
+from pieces import SQUARE_MASK, TO_SHIFT, TYPE_FIELD, PROMOTION_FIELD, PROMOTION_FLAG, DOUBLE_PUSH_FLAG, EN_PASSANT_FLAG, CAPTURE_FLAG, MOVE_FLAG, CASTLE_KING_SIDE_FLAG, CASTLE_QUEEN_SIDE_FLAG, PROMOTION_FLAGS
+from constants import Colour, PieceType, BOARD_WIDTH, BOARD_HEIGHT, START_FEN, SNAPSHOT_INTERVAL
+
+# Position records -> 32 bytes of square nibbles, two squares a byte (low nibble first), then the state
+# nibble 0 is empty, piece_type+1 is a white piece and 8|piece_type+1 a black one
+POSITION_RECORD = struct.Struct("<32sBBHH")
+# flags byte -> black to move in bit 0, then white kingside, white queenside, black kingside, black queenside
+BLACK_TO_MOVE = 1
+CASTLING_BITS = ((2, 4), (8, 16))
+NO_EN_PASSANT = 0xFF
+
+# Packed moves are cut down to 16 bits -> from (bits 0-5), to (6-11), promotion piece (12-13), promotion (14)
+# the move type is worked out again from the board when reading, as it only depends on the pieces moved
+PROMOTION_BIT = 1 << 14
+PROMOTION_INDEX_SHIFT = 12
+PROMOTION_INDEXES = {flag: index for index, flag in enumerate(PROMOTION_FLAGS)}
+
+# Files -> magic, then fixed size position records or a stream of games followed by an index of where each starts
+POSITIONS_MAGIC = b"CHESSPOS"
+GAMES_MAGIC = b"CHESSGMS"
+POSITIONS_EXTENSION = ".positions"
+GAMES_EXTENSION = ".games"
+# plies, snapshot interval -> then a position record every snapshot interval plies and a 16 bit move per ply
+GAME_HEADER = struct.Struct("<IH")
+# number of games, offset of the index -> at the very end so games can be written one at a time
+GAMES_FOOTER = struct.Struct("<QQ8s")
+INDEX_ENTRY = struct.Struct("<Q")
+
+# clocks are stored in 16 bits, no real game gets near it
+MAX_COUNTER = 0xFFFF
+
+# NIBBLE_TO_CHAR[nibble] -> FEN piece letter, '.' or None, so records decode to the same one character per square placement as FEN
+NIBBLE_TO_CHAR = ['.'] + [None]*15
+for piece_type in PieceType:
+    NIBBLE_TO_CHAR[piece_type+1] = PIECE_TO_CHAR[Colour.WHITE][piece_type]
+    NIBBLE_TO_CHAR[8 | piece_type+1] = PIECE_TO_CHAR[Colour.BLACK][piece_type]
+# BYTE_TO_SQUARES[byte] -> characters of both its squares, None if either nibble isn't a piece
+BYTE_TO_SQUARES = [None if NIBBLE_TO_CHAR[byte & 15] is None or NIBBLE_TO_CHAR[byte >> 4] is None
+                   else NIBBLE_TO_CHAR[byte & 15] + NIBBLE_TO_CHAR[byte >> 4] for byte in range(256)]
+
+
+class RecordError(ValueError):
+    def __init__(self, reason: str) -> None:
+        '''Raised for a file or record that isn't in the binary format or holds an impossible position'''
+        super().__init__(f"Invalid record, {reason}")
+        self.reason = reason
+
+
+class PositionFile:
+    def __init__(self, file_path: str) -> None:
+        '''Fixed size position records read straight from a memory mapped file, any record can be read without touching the rest'''
+        self.file = open(file_path, "rb")
+        self.data = map_file(self.file, POSITIONS_MAGIC)
+        self.count = (len(self.data) - len(POSITIONS_MAGIC)) // POSITION_RECORD.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_record(self, index: int) -> FENPosition:
+        '''Returns the position of record index'''
+        return decode_position(self.get_record_bytes(index))
+
+    def get_record_bytes(self, index: int) -> bytes:
+        '''Returns record index undecoded, e.g. to hand to another process'''
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        offset = len(POSITIONS_MAGIC) + index*POSITION_RECORD.size
+        return self.data[offset:offset + POSITION_RECORD.size]
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self) -> PositionFile:
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+class GameFile:
+    def __init__(self, file_path: str) -> None:
+        '''Games read from a memory mapped file, any ply of any game is reached from the snapshot before it without reading the others'''
+        self.file = open(file_path, "rb")
+        self.data = map_file(self.file, GAMES_MAGIC)
+        if len(self.data) < len(GAMES_MAGIC) + GAMES_FOOTER.size:
+            raise RecordError("games file has no index")
+        self.count, self.index_offset, magic = GAMES_FOOTER.unpack_from(self.data, len(self.data) - GAMES_FOOTER.size)
+        if magic != GAMES_MAGIC:
+            raise RecordError("games file has no index")
+        if not len(GAMES_MAGIC) <= self.index_offset <= len(self.data) - GAMES_FOOTER.size - self.count*INDEX_ENTRY.size:
+            raise RecordError("games index runs past the end of the file")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_game_offset(self, index: int) -> int:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        offset = INDEX_ENTRY.unpack_from(self.data, self.index_offset + index*INDEX_ENTRY.size)[0]
+        if not len(GAMES_MAGIC) <= offset <= self.index_offset - GAME_HEADER.size:
+            raise RecordError(f"game {index} starts outside the file")
+        return offset
+
+    def get_game_header(self, index: int) -> tuple[int, int, int]:
+        '''Returns the offset, plies and snapshot interval of game index, checking its snapshots and moves end before the index'''
+        offset = self.get_game_offset(index)
+        plies, snapshot_interval = GAME_HEADER.unpack_from(self.data, offset)
+        if snapshot_interval == 0:
+            raise RecordError(f"game {index} has a snapshot interval of 0")
+        if get_moves_offset(offset, plies, snapshot_interval) + 2*plies > self.index_offset:
+            raise RecordError(f"game {index} runs past the end of the file")
+        return offset, plies, snapshot_interval
+
+    def get_plies(self, index: int) -> int:
+        '''Returns how many moves game index has'''
+        return self.get_game_header(index)[1]
+
+    def get_start(self, index: int) -> FENPosition:
+        '''Returns the starting position of game index'''
+        return decode_position(self.data, self.get_game_header(index)[0] + GAME_HEADER.size)
+
+    def get_moves(self, index: int, engine: Engine, history: GameHistory = None, check_legal: bool = False) -> list[int]:
+        '''Returns every move of game index, replayed on the engine's board to restore the move types and added to history if given,
+        check_legal also generates the legal moves at every ply to catch a corrupt move before it's made'''
+        offset, plies, snapshot_interval = self.get_game_header(index)
+        engine.board.load_position(decode_position(self.data, offset + GAME_HEADER.size))
+
+        moves = []
+        moves_offset = get_moves_offset(offset, plies, snapshot_interval)
+        for code in self.get_move_codes(moves_offset, 0, plies):
+            move = unpack_move(engine.board, code)
+            if check_legal and move not in engine.generate_legal_moves()[1]:
+                raise RecordError(f"illegal move {code:#06x} at ply {len(moves)}")
+            engine.make_move(move)
+            moves.append(move)
+            if history is not None:
+                history.append(move, engine.board)
+        return moves
+
+    def load_position(self, index: int, ply: int, engine: Engine) -> None:
+        '''Puts the position after ply moves of game index on the engine's board'''
+        offset, plies, snapshot_interval = self.get_game_header(index)
+        if not 0 <= ply <= plies:
+            raise IndexError(ply)
+
+        # at most snapshot_interval-1 moves are replayed
+        snapshot = ply // snapshot_interval
+        engine.board.load_position(decode_position(self.data, offset + GAME_HEADER.size + snapshot*POSITION_RECORD.size))
+        moves_offset = get_moves_offset(offset, plies, snapshot_interval)
+        for code in self.get_move_codes(moves_offset, snapshot*snapshot_interval, ply):
+            engine.make_move(unpack_move(engine.board, code))
+
+    def get_move_codes(self, moves_offset: int, first_ply: int, last_ply: int) -> array:
+        codes = array('H', self.data[moves_offset + 2*first_ply:moves_offset + 2*last_ply])
+        if sys.byteorder == "big":
+            codes.byteswap()
+        return codes
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self) -> GameFile:
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+class GameWriter:
+    def __init__(self, file_path: str, snapshot_interval: int = SNAPSHOT_INTERVAL) -> None:
+        '''Appends games to a games file one at a time, only their offsets are kept until the index is written on close'''
+        self.file = open(file_path, "wb")
+        self.file.write(GAMES_MAGIC)
+        self.snapshot_interval = snapshot_interval
+        self.offsets = array('Q')
+        self.engine = Engine(Board())
+
+    def write_game(self, start_FEN: str, moves: Iterable[int]) -> None:
+        '''Adds a game given its starting position and packed moves'''
+        board = self.engine.board
+        board.load_FEN(start_FEN)
+        snapshots = [encode_position(board)]
+        codes = array('H')
+        for move in moves:
+            codes.append(pack_move(move))
+            self.engine.make_move(move)
+            if len(codes) % self.snapshot_interval == 0:
+                snapshots.append(encode_position(board))
+        if sys.byteorder == "big":
+            codes.byteswap()
+
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME_HEADER.pack(len(codes), self.snapshot_interval))
+        self.file.write(b"".join(snapshots))
+        self.file.write(codes.tobytes())
+
+    def close(self) -> None:
+        index_offset = self.file.tell()
+        for offset in self.offsets:
+            self.file.write(INDEX_ENTRY.pack(offset))
+        self.file.write(GAMES_FOOTER.pack(len(self.offsets), index_offset, GAMES_MAGIC))
+        self.file.close()
+
+    def __enter__(self) -> GameWriter:
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert positions or games into the binary formats")
+    parser.add_argument("source", help=f"FEN/EPD file for {POSITIONS_EXTENSION} output, PGN or FEN-per-line game for {GAMES_EXTENSION} output")
+    parser.add_argument("output", help=f"file ending in {POSITIONS_EXTENSION} or {GAMES_EXTENSION}")
+    args = parser.parse_args()
+
+    if args.output.endswith(POSITIONS_EXTENSION):
+        # imported here as batch imports this module
+        from batch import read_positions, parse_position
+        board = Board()
+        with open(args.source) as source_file, open(args.output, "wb") as output_file:
+            output_file.write(POSITIONS_MAGIC)
+            for line_number, line in read_positions(source_file):
+                # RecordError for clocks too big for a record is a ValueError too
+                try:
+                    board.load_FEN(parse_position(line)[0])
+                    record = encode_position(board)
+                except ValueError as error:
+                    print(f"line {line_number}: {error}, skipped", file=sys.stderr)
+                    continue
+                output_file.write(record)
+    elif args.output.endswith(GAMES_EXTENSION):
+        from pgn import read_games, replay_game
+        engine = Engine(Board())
+        with open(args.source) as source_file, GameWriter(args.output) as writer:
+            if args.source.endswith(".pgn"):
+                for game_number, game in enumerate(read_games(source_file), 1):
+                    # a game is only written once all of it is encoded, so a broken one leaves nothing behind
+                    try:
+                        writer.write_game(game.tags.get("FEN", START_FEN), replay_game(engine, game))
+                    except ValueError as error:
+                        print(f"game {game_number}: {error}, skipped", file=sys.stderr)
+            else:
+                FEN_strings = [line.strip() for line in source_file if line.strip()]
+                history = load_history(FEN_strings)
+                writer.write_game(history.snapshots[0], history.moves)
+    else:
+        parser.error(f"output has to end in {POSITIONS_EXTENSION} or {GAMES_EXTENSION}")
+
+
+def get_moves_offset(offset: int, plies: int, snapshot_interval: int) -> int:
+    # the move codes follow the header and every snapshot of a game
+    return offset + GAME_HEADER.size + (plies // snapshot_interval + 1)*POSITION_RECORD.size
+
+def map_file(file, magic: bytes) -> mmap.mmap:
+    # an empty file can't be mapped so the magic is checked first
+    if file.read(len(magic)) != magic:
+        raise RecordError(f"file doesn't start with {magic.decode()}")
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def encode_position(board: Board) -> bytes:
+    if board.half_moves > MAX_COUNTER or board.full_moves > MAX_COUNTER:
+        raise RecordError(f"move counters {board.half_moves} and {board.full_moves} don't fit in a record, the most is {MAX_COUNTER}")
+    nibbles = [0 if piece is None else (piece.colour << 3 | piece.piece_type+1) for piece in board.board]
+    squares = bytes(nibbles[square] | nibbles[square+1] << 4 for square in range(0, len(nibbles), 2))
+
+    flags = BLACK_TO_MOVE if board.current_turn == Colour.BLACK else 0
+    for colour in (Colour.WHITE, Colour.BLACK):
+        for side in range(2):
+            if board.castling_rights[colour][side]:
+                flags |= CASTLING_BITS[colour][side]
+    enpassant_x, enpassant_y, enpassant_pawn = board.enpassant_target
+    en_passant = NO_EN_PASSANT if enpassant_pawn is None else enpassant_x
+
+    return POSITION_RECORD.pack(squares, flags, en_passant, board.half_moves, board.full_moves)
+
+def decode_position(data: bytes, offset: int = 0) -> FENPosition:
+    # records go through the same rules as a parsed FEN, a file can be corrupt or come from anywhere
+    squares, flags, en_passant, half_moves, full_moves = POSITION_RECORD.unpack_from(data, offset)
+
+    chars = [BYTE_TO_SQUARES[byte] for byte in squares]
+    if None in chars:
+        index = chars.index(None)
+        raise RecordError(f"unknown piece on square {2*index} or {2*index + 1}")
+    squares = ''.join(chars)
+    if flags >> 5:
+        raise RecordError(f"unknown flags {flags:#04x}")
+
+    turn = Colour.BLACK if flags & BLACK_TO_MOVE else Colour.WHITE
+    castling_rights = tuple(tuple(bool(flags & CASTLING_BITS[colour][side]) for side in range(2)) for colour in (Colour.WHITE, Colour.BLACK))
+    enpassant_target = None
+    if en_passant != NO_EN_PASSANT:
+        if en_passant >= BOARD_WIDTH:
+            raise RecordError(f"en passant file {en_passant} is off the board")
+        # white captures onto the sixth rank, black onto the third
+        enpassant_target = (en_passant, 2 if turn == Colour.WHITE else BOARD_HEIGHT-3)
+
+    try:
+        validate_position(squares, turn, castling_rights, enpassant_target)
+    except PositionError as error:
+        raise RecordError(f"{error.field}, {error.reason}") from None
+    return FENPosition(get_pieces(squares), turn, castling_rights, enpassant_target, half_moves, full_moves)
+
+def pack_move(move: int) -> int:
+    code = move & (SQUARE_MASK | SQUARE_MASK << TO_SHIFT)
+    if move & TYPE_FIELD == PROMOTION_FLAG:
+        code |= PROMOTION_BIT | PROMOTION_INDEXES[move & (TYPE_FIELD | PROMOTION_FIELD)] << PROMOTION_INDEX_SHIFT
+    return code
+
+def unpack_move(board: Board, code: int) -> int:
+    # the move type comes back from the piece moved and what's on the target square, board is the position before the move
+    from_square = code & SQUARE_MASK
+    to_square = code >> TO_SHIFT & SQUARE_MASK
+    move = from_square | to_square << TO_SHIFT
+    if code & PROMOTION_BIT:
+        return move | PROMOTION_FLAGS[code >> PROMOTION_INDEX_SHIFT & 3]
+
+    if board.board[from_square] is None:
+        raise RecordError(f"move {code:#06x} from an empty square")
+    piece_type = board.board[from_square].piece_type
+    distance = to_square - from_square
+    if piece_type == PieceType.KING and (distance == 2 or distance == -2):
+        return move | (CASTLE_KING_SIDE_FLAG if distance > 0 else CASTLE_QUEEN_SIDE_FLAG)
+    if piece_type == PieceType.PAWN:
+        if distance == 2*BOARD_WIDTH or distance == -2*BOARD_WIDTH:
+            return move | DOUBLE_PUSH_FLAG
+        # a diagonal step onto an empty square can only be en passant
+        if distance % BOARD_WIDTH and board.board[to_square] is None:
+            return move | EN_PASSANT_FLAG
+    return move | (MOVE_FLAG if board.board[to_square] is None else CAPTURE_FLAG)
+
+def read_position_records(file_path: str) -> Iterator[tuple[int, bytes]]:
+    # (record number, record) for every record of a positions file, left undecoded so a bad one only fails itself wherever it's decoded
+    with PositionFile(file_path) as positions:
+        for index in range(len(positions)):
+            yield index, positions.get_record_bytes(index)
+
+def load_game_record(file_path: str, index: int = 0) -> GameHistory:
+    board = Board()
+    with GameFile(file_path) as games:
+        if not len(games):
+            raise RecordError("games file holds no games")
+        board.load_position(games.get_start(index))
+        history = GameHistory(board.get_FEN())
+        games.get_moves(index, Engine(board), history, check_legal=True)
+    return history
+
+def save_game_record(file_path: str, history: GameHistory, last_ply: int = None) -> None:
+    # written next to the old file and moved over it, so a game that can't be encoded leaves the old save alone
+    temporary_path = file_path + ".tmp"
+    try:
+        with GameWriter(temporary_path, history.snapshot_interval) as writer:
+            writer.write_game(history.snapshots[0], history.moves[:last_ply])
+    except ValueError:
+        os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, file_path)
+
+if __name__ == "__main__":
+    main()
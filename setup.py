@@ -1,22 +1,58 @@
 import pygame
 
 from tools.spritesheet import SpriteSheet
-from constants import SQUARE_SIZE, WINDOW_RESOLUTION, WINDOW_CAPTION, FONT_SIZE
+from tools.textcache import TextCache
+from constants import BOARD_WIDTH, BOARD_HEIGHT, RANKS, FILES
 
 # Setup pygame
 pygame.init()
+
+# Pygame Constants
+SCREEN = pygame.display.Info()
+SQUARE_SIZE = (min(SCREEN.current_w, SCREEN.current_h) - 100) // max(BOARD_WIDTH, BOARD_HEIGHT)
+# frame cap, also how often a board that isn't idle wakes up without input
+FPS = 60
+# idle boards sleep until there's input or the engine finishes -> no CPU used while waiting
+IDLE = True
+WINDOW_RESOLUTION = (BOARD_WIDTH*SQUARE_SIZE, BOARD_HEIGHT*SQUARE_SIZE)
+WINDOW_CAPTION = "CHESS"
+
+# Asset constants
+FONT_SIZE = SQUARE_SIZE//4
+FONT_COLOUR = (255,255,255)
+TEXT_OFFSET = SQUARE_SIZE//FONT_SIZE
+# scaled sprite atlases, rebuilt whenever a sheet or the square size changes
+SPRITE_CACHE = "assets/cache"
+
 window = pygame.display.set_mode(WINDOW_RESOLUTION)
 pygame.display.set_caption(WINDOW_CAPTION, WINDOW_CAPTION)
 clock = pygame.time.Clock()
+# the board never needs mouse movement, blocking it stops every twitch waking up the main loop
+pygame.event.set_blocked(pygame.MOUSEMOTION)
+
+# Custom events
+# posted by the engine's thread with its move once a search finishes
+ENGINE_MOVE_EVENT = pygame.event.custom_type()
 
 # Load all fonts
 FONT = pygame.font.Font("assets/fonts/DIN Condensed Bold.ttf", FONT_SIZE)
 
+# Render all text
+TEXT = TextCache(FONT)
+TEXT.prerender(RANKS + FILES, FONT_COLOUR)
+
 # Load all sprites
-PIECE_SPRITES = SpriteSheet("assets/sprites/custom-pieces.png", (150,150), (SQUARE_SIZE, SQUARE_SIZE), True).slice_sheet()
-SQUARE_SPRITES = SpriteSheet("assets/sprites/squares.png", (100,100), (SQUARE_SIZE, SQUARE_SIZE), True).slice_sheet()
-SYMBOL_SPRITES = SpriteSheet("assets/sprites/symbols.png", (100,100), (SQUARE_SIZE, SQUARE_SIZE), True).slice_sheet()
+# scaled atlases are kept in the cache for the next start, without one each sprite is scaled when first drawn
+SPRITE_SHEETS = (SpriteSheet("assets/sprites/custom-pieces.png", (150,150), (SQUARE_SIZE, SQUARE_SIZE), True, SPRITE_CACHE),
+                 SpriteSheet("assets/sprites/squares.png", (100,100), (SQUARE_SIZE, SQUARE_SIZE), True, SPRITE_CACHE),
+                 SpriteSheet("assets/sprites/symbols.png", (100,100), (SQUARE_SIZE, SQUARE_SIZE), True, SPRITE_CACHE))
+PIECE_SPRITES, SQUARE_SPRITES, SYMBOL_SPRITES = (sprite_sheet.slice_sheet() for sprite_sheet in SPRITE_SHEETS)
 
 # Load all sounds
 
 pygame.display.set_icon(PIECE_SPRITES[1])
+
+
+def save_sprite_caches() -> None:
+    for sprite_sheet in SPRITE_SHEETS:
+        sprite_sheet.save_cache()
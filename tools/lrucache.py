@@ -0,0 +1,29 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, capacity: int) -> None:
+        '''Holds up to capacity values, dropping the least recently used one when full'''
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        '''Returns the value stored for key, marking it as most recently used'''
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value) -> None:
+        '''Stores value for key, evicting the least recently used entry if over capacity'''
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        '''Empties the cache'''
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,36 +1,103 @@
+import os
 import pygame
 
 
 class SpriteSheet:
-    def __init__(self, file_path: str, sprite_dimension: tuple, resize_dimension: tuple = None, smooth_scale: bool = False) -> None:
+    def __init__(self, file_path: str, sprite_dimension: tuple, resize_dimension: tuple = None, smooth_scale: bool = False, cache_directory: str = None) -> None:
         '''Holds a spritesheet and associated sprite surfaces'''
         self.file_path = file_path
         self.sprite_dimension = sprite_dimension
         self.resize_dimension = resize_dimension
         self.smooth_scale = smooth_scale
+        self.cache_directory = cache_directory
 
-        self.sprite_sheet = pygame.image.load(file_path).convert_alpha()
+        # the source sheet is only loaded once a sprite has to be scaled from it
+        self.sprite_sheet = None
+        self.sprites = None
+
+    def load_sheet(self) -> pygame.Surface:
+        '''Returns the source sheet, loading it on first use'''
+        if self.sprite_sheet is None:
+            self.sprite_sheet = pygame.image.load(self.file_path).convert_alpha()
+        return self.sprite_sheet
+
+    def get_cache_path(self) -> str | None:
+        '''Returns the path of the scaled atlas for this sheet, keyed by the source mtime and target size'''
+        if self.cache_directory is None or self.resize_dimension is None:
+            return None
+        name = os.path.splitext(os.path.basename(self.file_path))[0]
+        width, height = self.resize_dimension
+        scale = "smooth" if self.smooth_scale else "fast"
+        return os.path.join(self.cache_directory, f"{name}-{os.stat(self.file_path).st_mtime_ns}-{width}x{height}-{scale}.png")
 
     def slice_sheet(self) -> dict[pygame.Surface]:
-        '''Returns a dictionary of all sprites in the sprite sheet'''
-        sprites = {}
+        '''Returns a dictionary of all sprites in the sprite sheet, from the cached atlas if there is one'''
+        cache_path = self.get_cache_path()
+        if cache_path is not None and os.path.exists(cache_path):
+            self.sprites = self.slice_atlas(pygame.image.load(cache_path).convert_alpha(), self.resize_dimension)
+        else:
+            self.sprites = LazySprites(self)
+        return self.sprites
+
+    def slice_atlas(self, atlas: pygame.Surface, dimension: tuple) -> dict[pygame.Surface]:
+        '''Returns a dictionary of subsurfaces of an atlas that is already at the right size'''
+        rows = atlas.get_height() // dimension[1]
+        columns = atlas.get_width() // dimension[0]
+        return {y*columns+x: atlas.subsurface((x*dimension[0], y*dimension[1], dimension[0], dimension[1]))
+                for y in range(rows) for x in range(columns)}
+
+    def get_grid(self) -> tuple[int, int]:
+        '''Returns the number of rows and columns of sprites in the source sheet'''
+        sheet = self.load_sheet()
+        return sheet.get_height() // self.sprite_dimension[1], sheet.get_width() // self.sprite_dimension[0]
 
-        rows = int(self.sprite_sheet.get_height()/self.sprite_dimension[1])
-        columns = int(self.sprite_sheet.get_width()/self.sprite_dimension[0])
+    def save_cache(self) -> None:
+        '''Writes every sprite into a scaled atlas on disk so the next start can skip scaling'''
+        cache_path = self.get_cache_path()
+        if cache_path is None or not isinstance(self.sprites, LazySprites):
+            return
 
-        for y in range(rows):
-            for x in range(columns):
-                sprites[int(y*columns+x)] = self.get_sprite(x*self.sprite_dimension[0], y*self.sprite_dimension[1])
+        rows, columns = self.get_grid()
+        width, height = self.resize_dimension
+        atlas = pygame.Surface((columns*width, rows*height), pygame.SRCALPHA)
+        for index in range(rows*columns):
+            atlas.blit(self.sprites[index], (index % columns * width, index // columns * height))
 
-        return sprites
+        # caching is best effort -> a read only install just scales every start
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            pygame.image.save(atlas, cache_path)
+            # atlases for an older sheet or another screen size are never used again
+            name = os.path.basename(cache_path).rsplit("-", 3)[0]
+            for file_name in os.listdir(self.cache_directory):
+                if file_name.rsplit("-", 3)[0] == name and os.path.join(self.cache_directory, file_name) != cache_path:
+                    os.remove(os.path.join(self.cache_directory, file_name))
+        except (OSError, pygame.error):
+            pass
 
     def get_sprite(self, x: int, y: int) -> pygame.Surface:
         '''Returns a pygame surface with sprite at location (x, y) drawn on it'''
         new_sprite = pygame.Surface((self.sprite_dimension[0], self.sprite_dimension[1]), pygame.SRCALPHA).convert_alpha()
-        new_sprite.blit(self.sprite_sheet, (0,0), (x, y, self.sprite_dimension[0], self.sprite_dimension[1]))
+        new_sprite.blit(self.load_sheet(), (0,0), (x, y, self.sprite_dimension[0], self.sprite_dimension[1]))
         if self.resize_dimension is not None:
             if self.smooth_scale:
                 new_sprite = pygame.transform.smoothscale(new_sprite, self.resize_dimension)
             else:
                 new_sprite = pygame.transform.scale(new_sprite, self.resize_dimension)
         return new_sprite
+
+
+class LazySprites(dict):
+    def __init__(self, sprite_sheet: SpriteSheet) -> None:
+        '''Sprites of a sheet without a cached atlas, each one is cut out and scaled the first time it is used'''
+        super().__init__()
+        self.sprite_sheet = sprite_sheet
+        self.rows, self.columns = sprite_sheet.get_grid()
+
+    def __missing__(self, index: int) -> pygame.Surface:
+        if not 0 <= index < self.rows*self.columns:
+            raise KeyError(index)
+        width, height = self.sprite_sheet.sprite_dimension
+        sprite = self.sprite_sheet.get_sprite(index % self.columns * width, index // self.columns * height)
+        self[index] = sprite
+        return sprite
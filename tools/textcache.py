@@ -0,0 +1,25 @@
+import pygame
+
+from tools.lrucache import LRUCache
+
+
+class TextCache:
+    def __init__(self, font: pygame.font.Font, capacity: int = 256) -> None:
+        '''Holds rendered text surfaces so each string and colour is only rasterized once'''
+        self.font = font
+        # bounded so text that keeps changing (clocks, evaluations) can't grow it forever
+        self.surfaces = LRUCache(capacity)
+
+    def render(self, text: str, colour: tuple) -> pygame.Surface:
+        '''Returns a surface with text drawn in colour, rendering it on first use'''
+        key = (text, colour)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.font.render(text, True, colour)
+            self.surfaces.put(key, surface)
+        return surface
+
+    def prerender(self, texts: list[str], colour: tuple) -> None:
+        '''Renders every text ahead of time, e.g. at startup'''
+        for text in texts:
+            self.render(text, colour)
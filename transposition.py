@@ -0,0 +1,70 @@
+from array import array
+
+from constants import Bound, Replacement
+
+# bytes per entry across all arrays -> key 8, score 8, depth 1, bound 1, age 1, best move 4
+ENTRY_SIZE = 23
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: int = 16, replacement: Replacement = Replacement.DEPTH_PREFERRED) -> None:
+        '''Fixed size hash table of search results, stored in flat arrays indexed by zobrist key'''
+        self.replacement = replacement
+
+        # round down to a power of two so an index is just the low bits of the key
+        entries = max(1, size_mb * 1024 * 1024 // ENTRY_SIZE)
+        self.size = 1 << (entries.bit_length() - 1)
+        self.mask = self.size - 1
+
+        self.age = 0
+        self.clear()
+
+    def clear(self) -> None:
+        '''Empties every entry'''
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('q', bytes(8 * self.size))
+        self.depths = array('b', [-1]) * self.size
+        self.bounds = array('B', bytes(self.size))
+        self.ages = array('B', bytes(self.size))
+        self.best_moves = array('I', bytes(4 * self.size))
+
+        self.hits = 0
+        self.probes = 0
+
+    def new_search(self) -> None:
+        '''Marks existing entries as stale so depth preferred replacement can overwrite them'''
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key: int) -> tuple[int, int, Bound, int]:
+        '''Returns (depth, score, bound, best move) stored for key or None if it isn't in the table'''
+        index = key & self.mask
+        self.probes += 1
+        if self.depths[index] < 0 or self.keys[index] != key:
+            return None
+        self.hits += 1
+        return self.depths[index], self.scores[index], Bound(self.bounds[index]), self.best_moves[index]
+
+    def store(self, key: int, depth: int, score: int, bound: Bound, best_move: int = 0) -> None:
+        '''Saves an entry for key, subject to the replacement policy'''
+        index = key & self.mask
+
+        if self.replacement == Replacement.DEPTH_PREFERRED:
+            # keep deeper results from the current search unless this is the same position
+            if (self.depths[index] > depth and self.keys[index] != key and self.ages[index] == self.age):
+                return
+
+        # keep the old best move if a shallower result for the same position doesn't have one
+        if not best_move and self.keys[index] == key:
+            best_move = self.best_moves[index]
+
+        self.keys[index] = key
+        self.scores[index] = score
+        self.depths[index] = depth
+        self.bounds[index] = bound
+        self.ages[index] = self.age
+        self.best_moves[index] = best_move
+
+    def get_usage(self) -> float:
+        '''Fraction of entries filled, sampled from the first thousand'''
+        sample = min(1000, self.size)
+        return sum(1 for index in range(sample) if self.depths[index] >= 0) / sample
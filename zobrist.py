@@ -0,0 +1,16 @@
+from random import Random
+
+# fixed seed so a position always gets the same key, even across processes
+generator = Random(0x5EED)
+
+def get_random_key() -> int:
+    return generator.getrandbits(64)
+
+# PIECE_KEYS[colour][piece_type][square]
+PIECE_KEYS = [[[get_random_key() for square in range(64)] for piece_type in range(6)] for colour in range(2)]
+# CASTLING_KEYS[colour][0 = kingside, 1 = queenside]
+CASTLING_KEYS = [[get_random_key() for side in range(2)] for colour in range(2)]
+# ENPASSANT_KEYS[x] -> only the file matters as the rank follows from whose turn it is, and only while a pawn can capture there
+ENPASSANT_KEYS = [get_random_key() for x in range(8)]
+# xored in while it is black's turn
+TURN_KEY = get_random_key()